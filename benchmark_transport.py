@@ -0,0 +1,56 @@
+"""
+Measure per-command latency of the host target transports.
+
+Usage: python benchmark_transport.py [-n ITERATIONS] [--transport tcp|unix|process]
+"""
+import argparse
+import statistics
+import time
+
+from test.test_pyroxene import compile
+
+
+def measure(operation, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    parser.add_argument("--transport", choices=("tcp", "unix", "process"), default="tcp")
+    args = parser.parse_args()
+
+    with compile(
+        """
+        #include <stdint.h>
+        uint32_t add(uint32_t a, uint32_t b) { return a + b; }
+        """,
+        unix_socket=args.transport == "unix",
+        process_memory=args.transport == "process",
+    ) as lib:
+        address = lib.pyroxene_memory._address
+        add = lib.add
+        operations = {
+            "echo": lambda: lib.com.echo(b"ping"),
+            "memory_read 4": lambda: lib.com.memory_read(address, 4),
+            "memory_read 4096": lambda: lib.com.memory_read(address, 4096),
+            "memory_write 4": lambda: lib.com.memory_write(address, b"\x00" * 4),
+            "call": lambda: add(1, 2),
+        }
+        print(f"transport: {args.transport}, iterations: {args.iterations}")
+        for name, operation in operations.items():
+            timings = measure(operation, args.iterations)
+            print(
+                f"{name:<20} median {statistics.median(timings) * 1e6:10.1f} us"
+                f"   mean {statistics.mean(timings) * 1e6:10.1f} us"
+                f"   max {max(timings) * 1e6:10.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,12 @@
 #include "pyroxene.h"
 #include "swap.h"
 
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#elif defined(__unix__)
+#include <time.h>
+#endif
+
 __attribute__((used, section(".pyroxene.data"))) uint8_t pyroxene_memory[PYROXENE_HEAP_SIZE] = { 0 };
 
 typedef union
@@ -18,11 +24,26 @@ typedef union
     uint8_t buffer[1024];
 } pyroxene_comdata_t;
 
-static pyroxene_comdata_t comdata;
+// Aligned, so that buffers within commands are aligned as well
+static pyroxene_comdata_t comdata __attribute__((aligned(sizeof(ulong))));
 
 const static uint8_t PYROXENE_ACK[3] = "ACK";
 const static uint8_t PYROXENE_NCK[3] = "NCK";
 
+// Integers in command data are in network byte order until the host negotiates native byte order.
+// The command header is always in network byte order.
+static uint8_t pyroxene_swap = 1;
+
+static inline ulong pyroxene_ntohl(ulong x)
+{
+    return pyroxene_swap ? ntohl(x) : x;
+}
+
+static inline uint16_t pyroxene_ntoh16(uint16_t x)
+{
+    return pyroxene_swap ? ntoh16(x) : x;
+}
+
 static void pyroxene_dispatch_echo(uint32_t data_length)
 {
     pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
@@ -31,8 +52,8 @@ static void pyroxene_dispatch_echo(uint32_t data_length)
 
 static void pyroxene_dispatch_memoryread(uint32_t data_length)
 {
-    uintptr_t address = ntohl(*(uintptr_t *)comdata.d.data);
-    ulong len = ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t)]);
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)comdata.d.data);
+    ulong len = pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t)]);
     // printf("pyroxene_dispatch_memoryread 0x%016x %lu\n", address, len);
     // uint8_t *data = alloca(len);
     // memcpy(data, (uint8_t *)address, len);
@@ -42,7 +63,7 @@ static void pyroxene_dispatch_memoryread(uint32_t data_length)
 
 static void pyroxene_dispatch_memorywrite(uint32_t data_length)
 {
-    uintptr_t address = ntohl(*(uintptr_t *)comdata.d.data);
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)comdata.d.data);
     // printf("pyroxene_dispatch_memorywrite 0x%016x", address);
     // for (size_t i = 0; i < data_length - sizeof(uintptr_t); i++)
     // {
@@ -53,33 +74,55 @@ static void pyroxene_dispatch_memorywrite(uint32_t data_length)
     pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
 }
 
-static void pyroxene_dispatch_call(uint32_t data_length)
+// Cycle counter used to measure calls. Targets may provide their own implementation.
+__attribute__((weak)) ulong pyroxene_cycles(void)
+{
+#if defined(__x86_64__) || defined(__i386__)
+    return (ulong)__rdtsc();
+#elif defined(__ARM_ARCH_7M__) || defined(__ARM_ARCH_7EM__) || defined(__ARM_ARCH_8M_MAIN__)
+    // DWT cycle counter, enabled on first use
+    volatile uint32_t *demcr = (volatile uint32_t *)0xE000EDFC;
+    volatile uint32_t *dwt_ctrl = (volatile uint32_t *)0xE0001000;
+    volatile uint32_t *dwt_cyccnt = (volatile uint32_t *)0xE0001004;
+    if (!(*dwt_ctrl & 1))
+    {
+        *demcr |= (1UL << 24);
+        *dwt_cyccnt = 0;
+        *dwt_ctrl |= 1;
+    }
+    return *dwt_cyccnt;
+#elif defined(__unix__)
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (ulong)now.tv_sec * 1000000000UL + (ulong)now.tv_nsec;
+#else
+    return 0;
+#endif
+}
+
+// Call function at `address`. If `cycles` is given, the elapsed cycles are stored there.
+static ulong pyroxene_invoke(uintptr_t address, uint16_t numparam_in, const ulong *params, ulong *cycles)
 {
-    uintptr_t address = ntohl(*(uintptr_t *)&comdata.d.data[0]);
 #ifdef __arm__
     address |= 1;
 #endif
-    uint16_t numbytes_out = ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t)]);
-    uint16_t numparam_in = ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t) + sizeof(uint16_t)]);
-
-    // printf("pyroxene_dispatch_call 0x%016lx %u %u\n", address, numbytes_out, numparam_in);
 
-#define offset_param1 (sizeof(uintptr_t) + sizeof(uint16_t) + sizeof(uint16_t))
-#define param1 (ntohl(*(ulong *)&comdata.d.data[offset_param1]))
-#define param2 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 1 * sizeof(ulong)]))
-#define param3 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 2 * sizeof(ulong)]))
-#define param4 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 3 * sizeof(ulong)]))
-#define param5 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 4 * sizeof(ulong)]))
-#define param6 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 5 * sizeof(ulong)]))
-#define param7 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 6 * sizeof(ulong)]))
-#define param8 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 7 * sizeof(ulong)]))
-#define param9 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 8 * sizeof(ulong)]))
-#define param10 (ntohl(*(ulong *)&comdata.d.data[offset_param1 + 9 * sizeof(ulong)]))
+#define param1 (params[0])
+#define param2 (params[1])
+#define param3 (params[2])
+#define param4 (params[3])
+#define param5 (params[4])
+#define param6 (params[5])
+#define param7 (params[6])
+#define param8 (params[7])
+#define param9 (params[8])
+#define param10 (params[9])
 
 #define call_case(_paramin) if (numparam_in == (_paramin))
 
     // Cases with ulong return
     ulong result = 0;
+    ulong start = cycles ? pyroxene_cycles() : 0;
     call_case(0)
     {
         result = ((uint64_t(*)(void))address)();
@@ -129,12 +172,240 @@ static void pyroxene_dispatch_call(uint32_t data_length)
         result = ((uint64_t(*)(ulong, ulong, ulong, ulong, ulong, ulong, ulong, ulong, ulong, ulong))
                       address)(param1, param2, param3, param4, param5, param6, param7, param8, param9, param10);
     }
-    result = ntohl(result);
+    if (cycles)
+    {
+        *cycles = pyroxene_cycles() - start;
+    }
+    return result;
+}
+
+// Read `count` parameters from `data` and convert them to host byte order
+static void pyroxene_read_params(ulong *params, const uint8_t *data, uint16_t count)
+{
+    if (count > PYROXENE_MAX_PARAMS)
+    {
+        count = PYROXENE_MAX_PARAMS;
+    }
+    memcpy(params, data, count * sizeof(ulong));
+    if (pyroxene_swap)
+    {
+        for (uint16_t i = 0; i < count; i++)
+        {
+            params[i] = ntohl(params[i]);
+        }
+    }
+}
+
+static void pyroxene_dispatch_call(uint32_t data_length)
+{
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[0]);
+    uint16_t numbytes_out = pyroxene_ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t)]);
+    uint16_t numparam_in = pyroxene_ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t) + sizeof(uint16_t)]);
+
+    // printf("pyroxene_dispatch_call 0x%016lx %u %u\n", address, numbytes_out, numparam_in);
+
+#define offset_param1 (sizeof(uintptr_t) + sizeof(uint16_t) + sizeof(uint16_t))
+    ulong params[PYROXENE_MAX_PARAMS];
+    pyroxene_read_params(params, &comdata.d.data[offset_param1], numparam_in);
+
+    ulong result = pyroxene_ntohl(pyroxene_invoke(address, numparam_in, params, NULL));
     // printf("result = %016lx\n", result);
     pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
     pyroxene_write((uint8_t *)&result, numbytes_out);
 }
 
+#define PYROXENE_CALL_OUT (1 << 0)
+#define PYROXENE_CALL_STAGED (1 << 1)
+#define PYROXENE_CALL_CYCLES (1 << 2)
+#define PYROXENE_CALL_STACK (1 << 3)
+
+#define PYROXENE_STACK_PATTERN ((ulong)0xa5a5a5a5a5a5a5a5ULL)
+// Words directly below the frame of the painting function which are left untouched (its own spills)
+#ifndef PYROXENE_STACK_MARGIN
+#define PYROXENE_STACK_MARGIN (4 * sizeof(ulong))
+#endif
+
+// Paint `depth` bytes of unused stack below the caller's frame with a pattern.
+// Must not call other functions: their frames would be located in the painted region.
+static __attribute__((noinline)) void pyroxene_stack_paint(ulong depth)
+{
+    volatile ulong *top = (volatile ulong *)((uintptr_t)__builtin_frame_address(0) - PYROXENE_STACK_MARGIN);
+    for (ulong i = 1; i <= depth / sizeof(ulong); i++)
+    {
+        top[-(long)i] = PYROXENE_STACK_PATTERN;
+    }
+}
+
+// Return the number of bytes below the caller's frame down to the deepest word which is not painted anymore.
+// Must be called from the same function as `pyroxene_stack_paint`.
+static __attribute__((noinline)) ulong pyroxene_stack_scan(ulong depth)
+{
+    volatile ulong *top = (volatile ulong *)((uintptr_t)__builtin_frame_address(0) - PYROXENE_STACK_MARGIN);
+    for (ulong i = depth / sizeof(ulong); i >= 1; i--)
+    {
+        if (top[-(long)i] != PYROXENE_STACK_PATTERN)
+        {
+            return PYROXENE_STACK_MARGIN + i * sizeof(ulong);
+        }
+    }
+    return 0;
+}
+
+static void pyroxene_dispatch_callex(uint32_t data_length)
+{
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[0]);
+    uint16_t numbytes_out = pyroxene_ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t)]);
+    uint16_t numparam_in = pyroxene_ntoh16(*(uint16_t *)&comdata.d.data[sizeof(uintptr_t) + sizeof(uint16_t)]);
+
+    ulong params[PYROXENE_MAX_PARAMS];
+    pyroxene_read_params(params, &comdata.d.data[offset_param1], numparam_in);
+    size_t offset = offset_param1 + numparam_in * sizeof(ulong);
+
+    ulong flags = pyroxene_ntohl(*(ulong *)&comdata.d.data[offset]);
+    offset += sizeof(ulong);
+    ulong outlength = 0;
+    if (flags & PYROXENE_CALL_OUT)
+    {
+        outlength = pyroxene_ntohl(*(ulong *)&comdata.d.data[offset]);
+        offset += sizeof(ulong);
+    }
+    if (flags & PYROXENE_CALL_STAGED)
+    {
+        // Parameters marked in `relmask` are offsets of buffers within this command
+        ulong relmask = pyroxene_ntohl(*(ulong *)&comdata.d.data[offset]);
+        offset += sizeof(ulong);
+        for (uint16_t i = 0; i < numparam_in && i < PYROXENE_MAX_PARAMS; i++)
+        {
+            if (relmask & (1UL << i))
+            {
+                params[i] = (ulong)&comdata.buffer[params[i]];
+            }
+        }
+    }
+    ulong depth = 0;
+    if (flags & PYROXENE_CALL_STACK)
+    {
+        depth = pyroxene_ntohl(*(ulong *)&comdata.d.data[offset]);
+        offset += sizeof(ulong);
+        pyroxene_stack_paint(depth);
+    }
+
+    ulong cycles = 0;
+    ulong result = pyroxene_invoke(address, numparam_in, params, (flags & PYROXENE_CALL_CYCLES) ? &cycles : NULL);
+    ulong stack = (flags & PYROXENE_CALL_STACK) ? pyroxene_ntohl(pyroxene_stack_scan(depth)) : 0;
+    result = pyroxene_ntohl(result);
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+    pyroxene_write((uint8_t *)&result, numbytes_out);
+    if (flags & PYROXENE_CALL_CYCLES)
+    {
+        cycles = pyroxene_ntohl(cycles);
+        pyroxene_write((uint8_t *)&cycles, sizeof(cycles));
+    }
+    if (flags & PYROXENE_CALL_STACK)
+    {
+        pyroxene_write((uint8_t *)&stack, sizeof(stack));
+    }
+    if (flags & PYROXENE_CALL_OUT)
+    {
+        // Respond with the output buffer the first parameter points to
+        pyroxene_write((uint8_t *)params[0], outlength);
+    }
+}
+
+static void pyroxene_dispatch_bench(uint32_t data_length)
+{
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[0]);
+    ulong repeat = pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t)]);
+    uint16_t numparam_in = (uint16_t)pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t) + sizeof(ulong)]);
+
+    ulong params[PYROXENE_MAX_PARAMS];
+    pyroxene_read_params(params, &comdata.d.data[sizeof(uintptr_t) + 2 * sizeof(ulong)], numparam_in);
+
+    // min, mean, max
+    ulong stats[3] = { repeat > 0 ? (ulong)-1 : 0, 0, 0 };
+    uint64_t total = 0;
+    for (ulong i = 0; i < repeat; i++)
+    {
+        ulong cycles;
+        pyroxene_invoke(address, numparam_in, params, &cycles);
+        total += cycles;
+        if (cycles < stats[0])
+        {
+            stats[0] = cycles;
+        }
+        if (cycles > stats[2])
+        {
+            stats[2] = cycles;
+        }
+    }
+    if (repeat > 0)
+    {
+        stats[1] = (ulong)(total / repeat);
+    }
+
+    for (int i = 0; i < 3; i++)
+    {
+        stats[i] = pyroxene_ntohl(stats[i]);
+    }
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+    pyroxene_write((uint8_t *)stats, sizeof(stats));
+}
+
+static void pyroxene_dispatch_map(uint32_t data_length)
+{
+    uintptr_t address = pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[0]);
+    ulong rows = pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t)]);
+    uint16_t numparam_in = (uint16_t)pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t) + sizeof(ulong)]);
+    // Both tables are located in device memory, thus use native byte order
+    const ulong *table
+        = (const ulong *)pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t) + 2 * sizeof(ulong)]);
+    ulong *results = (ulong *)pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t) + 3 * sizeof(ulong)]);
+
+    for (ulong i = 0; i < rows; i++)
+    {
+        results[i] = pyroxene_invoke(address, numparam_in, &table[i * numparam_in], NULL);
+    }
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+}
+
+static void pyroxene_dispatch_gather(uint32_t data_length)
+{
+    // Respond with the concatenation of all ranges [address, length]
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+    for (uint32_t offset = 0; offset + 2 * sizeof(ulong) <= data_length; offset += 2 * sizeof(ulong))
+    {
+        uintptr_t address = pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[offset]);
+        ulong len = pyroxene_ntohl(*(ulong *)&comdata.d.data[offset + sizeof(ulong)]);
+        pyroxene_write((uint8_t *)address, len);
+    }
+}
+
+static void pyroxene_dispatch_string(uint32_t data_length)
+{
+    // Respond with length and content of the NUL-terminated string at address, but at most max_length bytes
+    const uint8_t *address = (const uint8_t *)pyroxene_ntohl(*(uintptr_t *)&comdata.d.data[0]);
+    ulong max_length = pyroxene_ntohl(*(ulong *)&comdata.d.data[sizeof(uintptr_t)]);
+    ulong length = 0;
+    while (length < max_length && address[length] != 0)
+    {
+        length++;
+    }
+    ulong response = pyroxene_ntohl(length);
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+    pyroxene_write((uint8_t *)&response, sizeof(response));
+    pyroxene_write(address, length);
+}
+
+static void pyroxene_dispatch_byteorder(uint32_t data_length)
+{
+    // Select byte order of all following integers: 0 = network byte order, 1 = native byte order
+    pyroxene_swap = (data_length > 0 && comdata.d.data[0] == 1) ? 0 : 1;
+    // Respond with 1 in the selected byte order, so that the host learns it
+    uint16_t one = pyroxene_ntoh16(1);
+    pyroxene_write(PYROXENE_ACK, sizeof(PYROXENE_ACK));
+    pyroxene_write((uint8_t *)&one, sizeof(one));
+}
+
 __attribute__((noreturn)) void pyroxene_dispatcher(void)
 {
     while (1)
@@ -172,6 +443,36 @@ __attribute__((noreturn)) void pyroxene_dispatcher(void)
                 pyroxene_dispatch_call(data_length);
                 break;
             }
+            case 4: // Byte order [native[1]]
+            {
+                pyroxene_dispatch_byteorder(data_length);
+                break;
+            }
+            case 5: // Extended call [address[4] numparam_out[2] numparam_in[2] param_in1[4]? ... flags[4] ...]
+            {
+                pyroxene_dispatch_callex(data_length);
+                break;
+            }
+            case 6: // Benchmark [address[4] repeat[4] numparam_in[4] param_in1[4]? ...]
+            {
+                pyroxene_dispatch_bench(data_length);
+                break;
+            }
+            case 7: // Map [address[4] rows[4] numparam_in[4] table[4] results[4]]
+            {
+                pyroxene_dispatch_map(data_length);
+                break;
+            }
+            case 8: // Gather [address1[4] len1[4] ... addressn[4] lenn[4]]
+            {
+                pyroxene_dispatch_gather(data_length);
+                break;
+            }
+            case 9: // String [address[4] max_length[4]]
+            {
+                pyroxene_dispatch_string(data_length);
+                break;
+            }
             default:
                 break;
         }
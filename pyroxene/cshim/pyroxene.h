@@ -8,11 +8,15 @@
 #define PYROXENE_HEAP_SIZE (4 * 1024)
 #endif
 
+#define PYROXENE_MAX_PARAMS 10
+
 typedef unsigned long ulong;
 
 void pyroxene_dispatcher(void);
 void pyroxene_read(uint8_t *buffer, size_t length);
 void pyroxene_write(const uint8_t *buffer, size_t length);
+// Free running cycle counter (weak default: DWT CYCCNT, rdtsc or clock_gettime)
+ulong pyroxene_cycles(void);
 
 extern uint8_t pyroxene_memory[PYROXENE_HEAP_SIZE];
 
@@ -1,12 +1,144 @@
-from typing import List
+from collections import defaultdict, deque
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+import abc
+import bisect
+import itertools
 import logging
+import os
+import re
+import socket
 import struct
 import time
 
 
+# Flags of the extended call command
+PYROXENE_CALL_OUT = 1 << 0
+PYROXENE_CALL_STAGED = 1 << 1
+PYROXENE_CALL_CYCLES = 1 << 2
+PYROXENE_CALL_STACK = 1 << 3
+
+# Protocol commands by opcode
+PYROXENE_COMMANDS = (
+    "echo",
+    "memory_read",
+    "memory_write",
+    "call",
+    "byteorder",
+    "call_ex",
+    "bench",
+    "map",
+    "gather",
+    "string",
+)
+# Protocol commands accessing memory
+PYROXENE_MEMORY_COMMANDS = ("memory_read", "memory_write", "gather", "string")
+# Opcodes of protocol commands which may modify device memory
+PYROXENE_MODIFYING_COMMANDS = frozenset((2, 3, 5, 6, 7))
+
+
+class UnsupportedCommand(NotImplementedError):
+    """The communicator cannot execute a command, e.g. it needs the shim."""
+
+
+class CallResult(NamedTuple):
+    result: int
+    # Content of the buffer the first argument points to after the call
+    output: bytes = b""
+    # Cycles the device spent in the call
+    cycles: Optional[int] = None
+    # Bytes of stack used by the call
+    stack: Optional[int] = None
+
+
+class BenchResult(NamedTuple):
+    """Cycles per call of a benchmarked function."""
+
+    min: int
+    mean: int
+    max: int
+
+
+class PendingResponse:
+    """Response of a command issued through a `Pipeline`."""
+
+    def __init__(self, pipeline: Optional["Pipeline"] = None, value: Any = None):
+        self.pipeline = pipeline
+        self.value = value
+        self.done = pipeline is None
+
+    def result(self) -> Any:
+        """Wait for the response. Responses of all previously issued commands are collected before."""
+        while not self.done:
+            cast(Pipeline, self.pipeline).collect()
+        return self.value
+
+
+class Pipeline:
+    """
+    Issue commands without waiting for the responses of previously issued ones, see `Communicator.pipeline`.
+    This fallback executes every command immediately.
+    """
+
+    def __init__(self, com: "Communicator"):
+        self.com = com
+
+    def call(self, addr: int, numbytes_return: int, args: List[int]) -> PendingResponse:
+        return PendingResponse(value=self.com.call(addr, numbytes_return, args))
+
+    def memory_read(self, addr: int, size: int) -> PendingResponse:
+        return PendingResponse(value=self.com.memory_read(addr, size))
+
+    def memory_write(self, addr: int, data: bytes) -> PendingResponse:
+        self.com.memory_write(addr, data)
+        return PendingResponse()
+
+    def collect(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        """Collect the responses of all issued commands."""
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+
 class Communicator:
+    # Whether `map` is executed by the device, otherwise callers call row by row
+    supports_map = False
+    # Contents read within `LibProxy.snapshots()` by (address, size). Communicators discard them
+    # whenever device memory may change, see `invalidate_snapshots`.
+    snapshot_scope: Optional[Dict[Tuple[int, int], bytes]] = None
+
     def __init__(self):
         self.sizeof_long: int = 0
+        # Protocol commands issued so far per kind, see `PYROXENE_COMMANDS`
+        self.commands: Dict[str, int] = defaultdict(int)
+
+    @property
+    def memory_commands(self) -> int:
+        """Protocol commands accessing memory issued so far."""
+        return sum(self.commands[kind] for kind in PYROXENE_MEMORY_COMMANDS)
+
+    def invalidate_snapshots(self) -> None:
+        """Discard the contents read within `LibProxy.snapshots()`, e.g. on writes and calls."""
+        if self.snapshot_scope is not None:
+            self.snapshot_scope.clear()
 
     def memory_read(self, addr: int, size: int) -> bytes:
         ...
@@ -17,6 +149,86 @@ class Communicator:
     def call(self, addr: int, numbytes_return: int, args: List[int]) -> int:
         ...
 
+    def compile_call(self, numbytes_return: int, numargs: int) -> Callable[[int, List[int]], int]:
+        """
+        Return function equivalent to `call(addr, numbytes_return, args)` for `numargs` arguments.
+        Communicators may prepare the command once instead of per call.
+        """
+        return lambda addr, args: self.call(addr, numbytes_return, args)
+
+    def call_ex(
+        self,
+        addr: int,
+        numbytes_return: int,
+        args: List[int],
+        out_length: int = 0,
+        buffers: Optional[Dict[int, bytes]] = None,
+        cycles: bool = False,
+        stack_depth: int = 0,
+    ) -> CallResult:
+        """
+        Call function like `call`.
+        If `out_length` is given, additionally return `out_length` bytes of the buffer `args[0]` points to.
+        `buffers` maps argument indices to data which is passed within the command. The device provides it
+        during the call only. Raises `BufferError` if `buffers` cannot be passed.
+        If `cycles` is set, the device measures the cycles spent in the call.
+        If `stack_depth` is given, the device paints as many bytes of stack before the call
+        and measures the stack used by the call.
+        Raises `UnsupportedCommand` if a measurement is not supported, before calling the function.
+        """
+        if buffers:
+            raise BufferError("Passing buffers is not supported.")
+        if cycles:
+            raise UnsupportedCommand("Measuring cycles is not supported.")
+        if stack_depth:
+            raise UnsupportedCommand("Measuring stack usage is not supported.")
+        result = self.call(addr, numbytes_return, args)
+        output = self.memory_read(args[0], out_length) if out_length else b""
+        return CallResult(result, output)
+
+    def bench(self, addr: int, args: List[int], repeat: int) -> BenchResult:
+        """
+        Call function `repeat` times with the same arguments and return its cycles per call.
+        Only the shim counts cycles, thus there is no fallback: Raises `UnsupportedCommand`.
+        """
+        raise UnsupportedCommand("Benchmarking requires the bench command of the shim.")
+
+    def map(self, addr: int, rows: int, numargs: int, table: int, results: int) -> None:
+        """
+        Call function once per row of the argument table at `table` (`rows` x `numargs` unsigned longs)
+        and store the results in the table at `results` (`rows` unsigned longs).
+        Raises `UnsupportedCommand` unless `supports_map` is set.
+        """
+        raise UnsupportedCommand("Mapping requires the map command of the shim.")
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        """Read all `ranges` of (address, size)."""
+        return [self.memory_read(addr, size) for addr, size in ranges]
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        """
+        Read the NUL-terminated string at `addr` (without NUL), at most `max_length` bytes.
+        This fallback reads chunks of growing size, which may exceed the string by up to its length:
+        Callers limit `max_length` to the readable memory, see `LibProxy.string`.
+        """
+        result = b""
+        chunk = 32
+        while len(result) < max_length:
+            content = self.memory_read(addr + len(result), min(chunk, max_length - len(result)))
+            end = content.find(0)
+            if end != -1:
+                return result + content[:end]
+            result += content
+            chunk *= 2
+        return result
+
+    def pipeline(self) -> Pipeline:
+        """
+        Return a `Pipeline` issuing commands ahead of their responses.
+        Use it as context manager: Other commands may only be issued after it was left.
+        """
+        return Pipeline(self)
+
 
 class CommunicatorStub(Communicator):
     def __init__(self):
@@ -30,50 +242,213 @@ class CommunicatorStub(Communicator):
 
     def memory_write(self, addr: int, data: bytes) -> None:
         logging.getLogger(__name__).debug(f"PyroxeneCommand.memory_write {addr}, {data.hex()}")
+        self.invalidate_snapshots()
         for i, b in enumerate(data):
             self.memory[addr + i] = b
 
 
-class PyroxeneCommunicator(Communicator):
+class PyroxeneCommunicator(Communicator, abc.ABC):
     cmd_max_length = 1024
     cmd_header_length = 4
+    supports_map = True
+    # Byte order of integers in command data, see `negotiate_byteorder`
+    byteorder: Literal["little", "big"] = "big"
 
     def marshal_long(self, x: int) -> bytes:
-        return x.to_bytes(self.sizeof_long, "big")
+        return x.to_bytes(self.sizeof_long, self.byteorder)
 
     def unmarshal_long(self, x: bytes) -> int:
-        return int.from_bytes(x, "big")
+        return int.from_bytes(x, self.byteorder)
+
+    def _format(self, layout: str) -> str:
+        """Return `struct` format for `layout` in wire byte order. "L" denotes an `unsigned long`."""
+        return ("<" if self.byteorder == "little" else ">") + layout.replace(
+            "L", "Q" if self.sizeof_long == 8 else "I"
+        )
+
+    # Pipeline with responses still to be collected, see `PyroxenePipeline`
+    pending_pipeline: Optional["PyroxenePipeline"] = None
+
+    @abc.abstractmethod
+    def read(self, length: int) -> bytes:
+        """Read exactly `length` bytes from the link."""
+
+    @abc.abstractmethod
+    def write(self, data: bytes) -> None:
+        """Write `data` to the link."""
 
     def command(self, cmd, data, expected):
+        if self.pending_pipeline is not None:
+            self.pending_pipeline.flush()
+        self.commands[PYROXENE_COMMANDS[cmd]] += 1
+        if cmd in PYROXENE_MODIFYING_COMMANDS:
+            self.invalidate_snapshots()
         self.write(struct.pack("!HH", cmd, len(data)) + data)
+        return self.response(expected)
+
+    def response(self, expected):
         response = self.read(3)
         if response != b"ACK":
             raise Exception(f"Command did not respond successfully. response: {response}")
         response = self.read(expected)
         return response
 
+    def negotiate_byteorder(self, native: bool = True) -> None:
+        """
+        Select the byte order of integers in command data.
+        Native byte order of the target saves swapping on both sides, otherwise big endian is used.
+        Socket communicators negotiate on connection only if asked to (`native_byteorder=True`):
+        Shims without this command do not respond to it.
+        Serial communicators always negotiate on connection (timing out on such shims),
+        as the target keeps the byte order of a previous session.
+        """
+        response = self.command(4, bytes([1 if native else 0]), 2)
+        self.byteorder = "little" if response == b"\x01\x00" else "big"
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.negotiate_byteorder {native} -> {self.byteorder}")
+
+    def call_command(self, addr: int, numbytes_return: int, args: List[int]) -> Tuple[bytes, int]:
+        """Return data and response length of the call command."""
+        if numbytes_return > 0:
+            numbytes_return = self.sizeof_long
+        return (
+            struct.pack(self._format(f"LHH{len(args)}L"), addr, numbytes_return, len(args), *args),
+            numbytes_return,
+        )
+
     def call(self, addr: int, numbytes_return: int, args: List[int]) -> int:
+        callargs, numbytes_return = self.call_command(addr, numbytes_return, args)
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.call {callargs.hex()}, {numbytes_return} -> ...")
+        result = self.command(3, callargs, numbytes_return)
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.call ... -> {result}")
+        return self.unmarshal_long(result)
+
+    def compile_call(self, numbytes_return: int, numargs: int) -> Callable[[int, List[int]], int]:
+        if numbytes_return > 0:
+            numbytes_return = self.sizeof_long
+        body = struct.Struct(self._format(f"LHH{numargs}L"))
+        header = struct.pack("!HH", 3, body.size)
+        byteorder = self.byteorder
+        commands = self.commands
+
+        def call(addr: int, args: List[int]) -> int:
+            nonlocal body, byteorder
+            if self.byteorder != byteorder:
+                # Renegotiated, see `negotiate_byteorder`
+                body = struct.Struct(self._format(f"LHH{numargs}L"))
+                byteorder = self.byteorder
+            if self.pending_pipeline is not None:
+                self.pending_pipeline.flush()
+            commands["call"] += 1
+            self.invalidate_snapshots()
+            self.write(header + body.pack(addr, numbytes_return, numargs, *args))
+            return int.from_bytes(self.response(numbytes_return), byteorder)
+
+        return call
+
+    def call_ex(
+        self,
+        addr: int,
+        numbytes_return: int,
+        args: List[int],
+        out_length: int = 0,
+        buffers: Optional[Dict[int, bytes]] = None,
+        cycles: bool = False,
+        stack_depth: int = 0,
+    ) -> CallResult:
         if numbytes_return > 0:
             numbytes_return = self.sizeof_long
-        callargs = (
-            self.marshal_long(addr),
-            struct.pack("!HH", numbytes_return, len(args)),
-            b"".join(self.marshal_long(arg) for arg in args),
+        flags = PYROXENE_CALL_CYCLES if cycles else 0
+        options = []
+        if out_length:
+            flags |= PYROXENE_CALL_OUT
+            options.append(out_length)
+        if buffers:
+            flags |= PYROXENE_CALL_STAGED
+            options.append(sum(1 << i for i in buffers))
+        if stack_depth:
+            flags |= PYROXENE_CALL_STACK
+            options.append(stack_depth)
+        layout = self._format(f"LHH{len(args)}LL{len(options)}L")
+
+        # Buffers are appended aligned to `unsigned long`. The respective arguments hold their offsets
+        # within the command which the device converts to pointers.
+        payload = b""
+        if buffers:
+            args = list(args)
+            offset = self.cmd_header_length + struct.calcsize(layout)
+            for i, content in sorted(buffers.items()):
+                padding = -offset % self.sizeof_long
+                payload += bytes(padding) + content
+                args[i] = offset + padding
+                offset += padding + len(content)
+            if offset > self.cmd_max_length:
+                raise BufferError(f"Buffers exceed command length: {offset} > {self.cmd_max_length}")
+
+        callargs = struct.pack(layout, addr, numbytes_return, len(args), *args, flags, *options) + payload
+        logging.getLogger(__name__).debug(
+            f"PyroxeneCommand.call_ex {callargs.hex()}, {numbytes_return}, {out_length} -> ..."
+        )
+        # Response: result | cycles? | stack? | output?
+        numbytes_cycles = self.sizeof_long if cycles else 0
+        numbytes_stack = self.sizeof_long if stack_depth else 0
+        response = self.command(5, callargs, numbytes_return + numbytes_cycles + numbytes_stack + out_length)
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.call_ex ... -> {response.hex()}")
+        offset_stack = numbytes_return + numbytes_cycles
+        return CallResult(
+            self.unmarshal_long(response[:numbytes_return]),
+            response[offset_stack + numbytes_stack :],
+            self.unmarshal_long(response[numbytes_return:offset_stack]) if cycles else None,
+            (
+                self.unmarshal_long(response[offset_stack : offset_stack + numbytes_stack])
+                if stack_depth
+                else None
+            ),
         )
+
+    def bench(self, addr: int, args: List[int], repeat: int) -> BenchResult:
+        benchargs = struct.pack(self._format(f"LLL{len(args)}L"), addr, repeat, len(args), *args)
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.bench {benchargs.hex()} -> ...")
+        response = self.command(6, benchargs, 3 * self.sizeof_long)
+        result = BenchResult(*struct.unpack(self._format("LLL"), response))
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.bench ... -> {result}")
+        return result
+
+    def map(self, addr: int, rows: int, numargs: int, table: int, results: int) -> None:
         logging.getLogger(__name__).debug(
-            f"PyroxeneCommand.call {' '.join(c.hex() for c in callargs)}, {numbytes_return} -> ..."
+            f"PyroxeneCommand.map 0x{addr:08x}, {rows}, {numargs}, 0x{table:08x}, 0x{results:08x}"
         )
-        result = self.command(3, b"".join(callargs), numbytes_return)
-        logging.getLogger(__name__).debug(f"PyroxeneCommand.call ... -> {result}")
-        return self.unmarshal_long(result)
+        self.command(7, struct.pack(self._format("LLLLL"), addr, rows, numargs, table, results), 0)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        result = []
+        # Ranges per command
+        count = (self.cmd_max_length - self.cmd_header_length) // (2 * self.sizeof_long)
+        for i in range(0, len(ranges), count):
+            portion = ranges[i : i + count]
+            logging.getLogger(__name__).debug(f"PyroxeneCommand.gather {portion} -> ...")
+            response = self.command(
+                8,
+                struct.pack(self._format(f"{2 * len(portion)}L"), *itertools.chain(*portion)),
+                sum(size for _, size in portion),
+            )
+            logging.getLogger(__name__).debug(f"PyroxeneCommand.gather ... -> {response.hex()}")
+            offset = 0
+            for _, size in portion:
+                result.append(response[offset : offset + size])
+                offset += size
+        return result
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.string 0x{addr:08x}, {max_length} -> ...")
+        response = self.command(9, struct.pack(self._format("LL"), addr, max_length), self.sizeof_long)
+        length = self.unmarshal_long(response)
+        result = self.read(length)
+        logging.getLogger(__name__).debug(f"PyroxeneCommand.string ... -> {result!r}")
+        return result
 
     def memory_read(self, addr: int, size: int) -> bytes:
         logging.getLogger(__name__).debug(f"PyroxeneCommand.memory_read 0x{addr:08x}, {size} -> ...")
-        result = self.command(
-            1,
-            self.marshal_long(addr) + self.marshal_long(size),
-            size,
-        )
+        result = self.command(1, struct.pack(self._format("LL"), addr, size), size)
         logging.getLogger(__name__).debug(f"PyroxeneCommand.memory_read ... -> {result.hex()}")
         return result
 
@@ -81,11 +456,18 @@ class PyroxeneCommunicator(Communicator):
         if len(data) == 0:
             return
         logging.getLogger(__name__).debug(f"PyroxeneCommand.memory_write 0x{addr:08x}, {data.hex()}")
+        for portion in self.memory_write_commands(addr, data):
+            self.command(2, portion, 0)
+
+    def memory_write_commands(self, addr: int, data: bytes) -> List[bytes]:
+        """Split write of `data` into the data of several commands fitting into `cmd_max_length`."""
+        commands = []
         while len(data) != 0:
             portion = data[: self.cmd_max_length - self.sizeof_long - self.cmd_header_length]
-            self.command(2, self.marshal_long(addr) + portion, 0)
+            commands.append(self.marshal_long(addr) + portion)
             addr += len(portion)
             data = data[len(portion) :]
+        return commands
 
     def echo(self, data: bytes) -> bytes:
         result = self.command(0, data, len(data))
@@ -93,8 +475,67 @@ class PyroxeneCommunicator(Communicator):
         return result
 
 
+class PyroxenePipeline(Pipeline):
+    """
+    Pipeline sending commands while the device still executes previous ones.
+    Requires a link which buffers the commands until the device reads them, e.g. a socket.
+    """
+
+    com: PyroxeneCommunicator
+
+    def __init__(self, com: PyroxeneCommunicator):
+        super().__init__(com)
+        self.pending: Deque[Tuple[PendingResponse, int, Callable[[bytes], Any]]] = deque()
+        if com.pending_pipeline is not None:
+            com.pending_pipeline.flush()
+        com.pending_pipeline = self
+
+    def _issue(self, cmd: int, data: bytes, expected: int, decode: Callable[[bytes], Any]) -> PendingResponse:
+        self.com.commands[PYROXENE_COMMANDS[cmd]] += 1
+        if cmd in PYROXENE_MODIFYING_COMMANDS:
+            self.com.invalidate_snapshots()
+        self.com.write(struct.pack("!HH", cmd, len(data)) + data)
+        pending = PendingResponse(self)
+        self.pending.append((pending, expected, decode))
+        return pending
+
+    def call(self, addr: int, numbytes_return: int, args: List[int]) -> PendingResponse:
+        callargs, numbytes_return = self.com.call_command(addr, numbytes_return, args)
+        logging.getLogger(__name__).debug(f"PyroxenePipeline.call {callargs.hex()}, {numbytes_return}")
+        return self._issue(3, callargs, numbytes_return, self.com.unmarshal_long)
+
+    def memory_read(self, addr: int, size: int) -> PendingResponse:
+        logging.getLogger(__name__).debug(f"PyroxenePipeline.memory_read 0x{addr:08x}, {size}")
+        return self._issue(1, struct.pack(self.com._format("LL"), addr, size), size, bytes)
+
+    def memory_write(self, addr: int, data: bytes) -> PendingResponse:
+        logging.getLogger(__name__).debug(f"PyroxenePipeline.memory_write 0x{addr:08x}, {data.hex()}")
+        pending = PendingResponse()
+        for portion in self.com.memory_write_commands(addr, data):
+            pending = self._issue(2, portion, 0, lambda _: None)
+        return pending
+
+    def collect(self) -> None:
+        """Collect the oldest outstanding response."""
+        pending, expected, decode = self.pending.popleft()
+        pending.value = decode(self.com.response(expected))
+        pending.done = True
+
+    def flush(self) -> None:
+        while self.pending:
+            self.collect()
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+        if self.com.pending_pipeline is self:
+            self.com.pending_pipeline = None
+
+
 class PyroxeneSerialCommunicator(PyroxeneCommunicator):
-    def __init__(self, port, baud, sizeof_long, initial_timeout=2.0, log_support=True):
+    def __init__(
+        self, port, baud, sizeof_long, initial_timeout=2.0, log_support=True, native_byteorder=False
+    ):
+        super().__init__()
         self.sizeof_long = sizeof_long
         self.log_support = log_support
 
@@ -107,11 +548,18 @@ class PyroxeneSerialCommunicator(PyroxeneCommunicator):
             self.ser.timeout = initial_timeout
             if self.echo(b"hello") == b"hello":
                 break
+        # The target keeps its state across sessions: always select the byte order,
+        # otherwise a previous session's native byte order would still be in effect.
+        try:
+            self.negotiate_byteorder(native_byteorder)
+        except TimeoutError:
+            # Shims predating the byteorder command do not respond, they always use big endian
+            self.ser.read_all()
+            self.byteorder = "big"
         self.ser.timeout = None
 
-    def command(self, cmd, data, expected):
+    def response(self, expected):
         if self.log_support:
-            self.write(struct.pack("!HH", cmd, len(data)) + data)
             while True:
                 response = self.read(3)
                 if response == b"ACK":
@@ -125,7 +573,7 @@ class PyroxeneSerialCommunicator(PyroxeneCommunicator):
                     raise Exception(f"Command did not respond successfully. response: {response}")
             return response
         else:
-            return super().command(cmd, data, expected)
+            return super().response(expected)
 
     def read(self, length):
         data = self.ser.read(length)
@@ -138,23 +586,350 @@ class PyroxeneSerialCommunicator(PyroxeneCommunicator):
 
 
 class PyroxeneSocketCommunicator(PyroxeneCommunicator):
-    def __init__(self, address, sizeof_long):
+    family = socket.AF_INET
+
+    def __init__(self, address, sizeof_long, nodelay=True, native_byteorder=False):
+        super().__init__()
         self.sizeof_long = sizeof_long
-        import socket
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Not yet connected, see `__del__`
+        self.sockfile = None
+        self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+        if nodelay and self.family == socket.AF_INET:
+            # Every command is a small frame waiting for a small response:
+            # Nagle's algorithm combined with delayed ACKs would stall each of them.
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.sock.connect(address)
+        # Buffered reading: "ACK" and the response are usually fetched with a single `recv`
+        self.sockfile = self.sock.makefile("rb")
         if self.echo(b"hello") != b"hello":
             raise Exception("Something went wrong.")
+        if native_byteorder:
+            self.negotiate_byteorder()
+
+    @staticmethod
+    def connect_announced(
+        stream, sizeof_long: int, host: str = "localhost", **kwargs
+    ) -> "PyroxeneSocketCommunicator":
+        """
+        Connect to the address a target announces on `stream` (e.g. stdout of `test/host`)
+        as "pyroxene: listening on tcp:<port>" or "pyroxene: listening on unix:<path>".
+        This allows targets to listen on ephemeral ports.
+        """
+        for line in stream:
+            if isinstance(line, bytes):
+                line = line.decode()
+            match = re.match(r"^pyroxene: listening on (tcp|unix):(.+)$", line.strip())
+            if not match:
+                continue
+            if match.group(1) == "unix":
+                return PyroxeneUnixSocketCommunicator(match.group(2), sizeof_long, **kwargs)
+            return PyroxeneSocketCommunicator((host, int(match.group(2))), sizeof_long, **kwargs)
+        raise ConnectionError("Target did not announce its address.")
+
+    def pipeline(self) -> Pipeline:
+        # Commands wait in the socket buffers of the host until the device is ready
+        return PyroxenePipeline(self)
 
     def read(self, length):
-        data = b""
-        while len(data) < length:
-            data += self.sock.recv(length - len(data))
+        data = self.sockfile.read(length)
+        if len(data) != length:
+            raise ConnectionError("Connection closed by device.")
         return data
 
     def write(self, data):
         self.sock.sendall(data)
 
     def __del__(self):
+        if self.sockfile is not None:
+            self.sockfile.close()
         self.sock.close()
+
+
+class PyroxeneUnixSocketCommunicator(PyroxeneSocketCommunicator):
+    """
+    Communicator for targets running on the same machine (e.g. `test/host`).
+    A Unix domain socket avoids the TCP/IP stack and its loopback latency.
+    """
+
+    family = socket.AF_UNIX
+
+    def __init__(self, path: str, sizeof_long: int, nodelay=True, native_byteorder=False):
+        # `nodelay` only applies to TCP, it is accepted for `connect_announced`
+        super().__init__(path, sizeof_long, nodelay=nodelay, native_byteorder=native_byteorder)
+
+
+class CommunicatorWrapper(Communicator):
+    """Base of communicators adding behavior to `communicator`. Everything is forwarded by default."""
+
+    def __init__(self, communicator: Communicator):
+        self.communicator = communicator
+        self.sizeof_long = communicator.sizeof_long
+
+    @property
+    def commands(self) -> Dict[str, int]:  # type: ignore[override]
+        return self.communicator.commands
+
+    def __getattr__(self, name):
+        # Forward everything else, e.g. `echo`
+        return getattr(self.communicator, name)
+
+    def memory_read(self, addr: int, size: int) -> bytes:
+        return self.communicator.memory_read(addr, size)
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        self.communicator.memory_write(addr, data)
+
+    def call(self, addr: int, numbytes_return: int, args: List[int]) -> int:
+        return self.communicator.call(addr, numbytes_return, args)
+
+    def call_ex(self, *args, **kwargs) -> CallResult:
+        return self.communicator.call_ex(*args, **kwargs)
+
+    def bench(self, addr: int, args: List[int], repeat: int) -> BenchResult:
+        return self.communicator.bench(addr, args, repeat)
+
+    @property
+    def supports_map(self) -> bool:  # type: ignore[override]
+        return self.communicator.supports_map
+
+    @property  # type: ignore[override]
+    def snapshot_scope(self) -> Optional[Dict[Tuple[int, int], bytes]]:
+        return self.communicator.snapshot_scope
+
+    @snapshot_scope.setter
+    def snapshot_scope(self, scope: Optional[Dict[Tuple[int, int], bytes]]) -> None:
+        self.communicator.snapshot_scope = scope
+
+    def map(self, addr: int, rows: int, numargs: int, table: int, results: int) -> None:
+        return self.communicator.map(addr, rows, numargs, table, results)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        return self.communicator.gather(ranges)
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        return self.communicator.string(addr, max_length)
+
+    def pipeline(self) -> Pipeline:
+        return self.communicator.pipeline()
+
+
+class DetachedCommunicator(CommunicatorWrapper):
+    """
+    Communicator of proxies decoding local data which has no device address, see `LibProxy.from_buffer`.
+    Writes raise `TypeError` instead of modifying device memory at meaningless addresses.
+    """
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        raise TypeError("Cannot write: The proxy has no device address.")
+
+
+class ProcessMemoryCommunicator(CommunicatorWrapper):
+    """
+    Communicator for targets running as local process (e.g. `test/host`).
+
+    `memory_read` and `memory_write` directly access the memory of process `pid` through `/proc/<pid>/mem`.
+    Calls, and memory accesses if access to the process is denied, go through `communicator`.
+    """
+
+    def __init__(self, pid: int, communicator: Communicator):
+        super().__init__(communicator)
+        self.fd: Optional[int] = None
+        try:
+            self.fd = os.open(f"/proc/{pid}/mem", os.O_RDWR)
+        except OSError as exc:
+            logging.getLogger(__name__).debug(f"ProcessMemoryCommunicator: Fall back to protocol: {exc}")
+
+    def _denied(self, exc: OSError):
+        logging.getLogger(__name__).debug(f"ProcessMemoryCommunicator: Fall back to protocol: {exc}")
+        if isinstance(exc, PermissionError):
+            self.close()
+
+    def memory_read(self, addr: int, size: int) -> bytes:
+        if self.fd is not None:
+            try:
+                result = os.pread(self.fd, size, addr)
+                if len(result) == size:
+                    logging.getLogger(__name__).debug(
+                        f"ProcessMemoryCommunicator.memory_read 0x{addr:08x}, {size} -> {result.hex()}"
+                    )
+                    return result
+            except OSError as exc:
+                self._denied(exc)
+        return self.communicator.memory_read(addr, size)
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        if self.fd is not None:
+            self.invalidate_snapshots()
+            try:
+                logging.getLogger(__name__).debug(
+                    f"ProcessMemoryCommunicator.memory_write 0x{addr:08x}, {data.hex()}"
+                )
+                if os.pwrite(self.fd, data, addr) == len(data):
+                    return
+            except OSError as exc:
+                self._denied(exc)
+        self.communicator.memory_write(addr, data)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        if self.fd is not None:
+            return Communicator.gather(self, ranges)
+        return self.communicator.gather(ranges)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class ReadOnlyMemoryCommunicator(CommunicatorWrapper):
+    """
+    Serves reads of read-only memory from local `regions` of (address, content) instead of `communicator`,
+    e.g. lookup tables and string literals from `ElfBackend.read_only_regions`.
+    With `verify`, the memory is read from the device nevertheless and compared to the local content.
+    Writes to the regions raise `TypeError`.
+    """
+
+    def __init__(
+        self,
+        communicator: Communicator,
+        regions: Iterable[Tuple[int, Union[bytes, memoryview]]],
+        verify: bool = False,
+    ):
+        super().__init__(communicator)
+        self.regions = sorted(regions, key=lambda region: region[0])
+        self.starts = [address for address, _ in self.regions]
+        self.verify = verify
+
+    def local(self, addr: int, size: int) -> Optional[bytes]:
+        """Local content of [addr, addr + size) or None if not within a region."""
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i < 0:
+            return None
+        start, content = self.regions[i]
+        if addr + size > start + len(content):
+            return None
+        return bytes(content[addr - start : addr - start + size])
+
+    def _verified(self, addr: int, local: bytes, remote: bytes) -> bytes:
+        if local != remote:
+            raise ValueError(
+                f"Read-only memory at 0x{addr:08x} differs: {remote.hex()} instead of {local.hex()}"
+            )
+        return local
+
+    def memory_read(self, addr: int, size: int) -> bytes:
+        local = self.local(addr, size)
+        if local is None:
+            return self.communicator.memory_read(addr, size)
+        if self.verify:
+            return self._verified(addr, local, self.communicator.memory_read(addr, size))
+        return local
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        # The local content would be stale
+        i = bisect.bisect_right(self.starts, addr + len(data) - 1) - 1
+        if data and i >= 0 and self.regions[i][0] + len(self.regions[i][1]) > addr:
+            raise TypeError(f"Cannot write read-only memory at 0x{addr:08x}")
+        self.communicator.memory_write(addr, data)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        known = [self.local(addr, size) for addr, size in ranges]
+        # Read everything else with a single gather
+        remote = [r for r, local in zip(ranges, known) if local is None or self.verify]
+        contents = iter(self.communicator.gather(remote) if remote else [])
+        result = []
+        for (addr, _), local in zip(ranges, known):
+            if local is None:
+                result.append(next(contents))
+            elif self.verify:
+                result.append(self._verified(addr, local, next(contents)))
+            else:
+                result.append(local)
+        return result
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        local = None
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0:
+            start, content = self.regions[i]
+            candidate = bytes(content[addr - start : addr - start + max_length])
+            end = candidate.find(0)
+            if end != -1:
+                local = candidate[:end]
+            elif candidate and len(candidate) == max_length:
+                local = candidate
+        if local is None:
+            # Not within a region (or not terminated within)
+            return self.communicator.string(addr, max_length)
+        if self.verify:
+            # Compares the lengths as well
+            return self._verified(addr, local, self.communicator.string(addr, max_length))
+        return local
+
+    def pipeline(self) -> Pipeline:
+        # Issue every command through this wrapper to serve reads locally
+        return Communicator.pipeline(self)
+
+
+class CountingCommunicator(CommunicatorWrapper):
+    """
+    Counts the protocol commands issued through `communicator` (e.g. a large write split into
+    several commands counts as several) and the bytes of memory read and written.
+    """
+
+    def __init__(self, communicator: Communicator):
+        super().__init__(communicator)
+        self.counted: Dict[str, int] = defaultdict(int)
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @property
+    def commands(self) -> Dict[str, int]:  # type: ignore[override]
+        return self.counted
+
+    def _count(self, operation: Callable[..., Any], *args, **kwargs) -> Any:
+        # Protocol commands are counted by `communicator`, attribute the ones issued by `operation`
+        before = dict(self.communicator.commands)
+        try:
+            return operation(*args, **kwargs)
+        finally:
+            for kind, count in self.communicator.commands.items():
+                if count != before.get(kind, 0):
+                    self.counted[kind] += count - before.get(kind, 0)
+
+    def memory_read(self, addr: int, size: int) -> bytes:
+        self.bytes_read += size
+        return self._count(super().memory_read, addr, size)
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        self.bytes_written += len(data)
+        self._count(super().memory_write, addr, data)
+
+    def call(self, addr: int, numbytes_return: int, args: List[int]) -> int:
+        return self._count(super().call, addr, numbytes_return, args)
+
+    def call_ex(self, *args, **kwargs) -> CallResult:
+        return self._count(super().call_ex, *args, **kwargs)
+
+    def bench(self, addr: int, args: List[int], repeat: int) -> BenchResult:
+        return self._count(super().bench, addr, args, repeat)
+
+    def map(self, addr: int, rows: int, numargs: int, table: int, results: int) -> None:
+        return self._count(super().map, addr, rows, numargs, table, results)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        self.bytes_read += sum(size for _, size in ranges)
+        return self._count(super().gather, ranges)
+
+    def pipeline(self) -> Pipeline:
+        # Issue every command through this wrapper to count it
+        return Communicator.pipeline(self)
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        result = self._count(super().string, addr, max_length)
+        self.bytes_read += len(result)
+        return result
@@ -1,8 +1,39 @@
-from typing import List, Type, Union, cast
+import asyncio
+import itertools
+import operator
+import re
+import struct
+import sys
+import time
+import types
+import warnings
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
 from .companion_generator import PYROXENE_COMPANION_PREFIX, PYROXENE_COMPANION_PREFIX_PTR
-from .device_commands import Communicator
-from .elfbackend import CType, CTypeArray, CTypeFunction, ElfBackend
+from .device_commands import (
+    BenchResult,
+    CallResult,
+    Communicator,
+    DetachedCommunicator,
+    UnsupportedCommand,
+)
+from .elfbackend import CType, CTypeArray, CTypeFunction, CTypeVariable, ElfBackend
+from .layouts import INT_FORMATS, RecordCodec, dtype_of
+from .metrics import CallProfile, CallTimings, StackUsage
 
 
 def chunks(thelist, chunksize):
@@ -10,6 +41,11 @@ def chunks(thelist, chunksize):
         yield thelist[i : i + chunksize]
 
 
+def is_ndarray(obj) -> bool:
+    # Do not import numpy (optional) unless already in use
+    return "numpy" in sys.modules and isinstance(obj, sys.modules["numpy"].ndarray)
+
+
 def uint2int(value, size):
     minus_one = int.from_bytes(size * b"\xff", "big")
     if value >> (8 * size - 1) != 0:
@@ -35,7 +71,7 @@ class VarProxy:
     @staticmethod
     def new2(backend: ElfBackend, com: Communicator, type: CType, address: int, length: int = -1, data=None):
         if type.kind in ("struct", "typedef struct"):
-            cls: Type[Union[VarProxy, VarProxyStruct]] = VarProxyStruct
+            cls: Type[Union[VarProxy, VarProxyStruct]] = struct_proxy_class(type)
         else:
             cls = VarProxy
         return cls(backend, com, type, address, length, data)
@@ -64,14 +100,15 @@ class VarProxy:
         return f"<{self.__class__.__name__} {self._type}[{self._length}] @ 0x{self._address or 0:08x}>"
 
     def _getitem_single(self, index, content=None):
+        size = self._type.size
         newvarproxy = self.new2(
             self._backend,
             self._com,
             self._type,
-            self._address + index * self._type.size,
-            data=self._data[index * self._type.size :] if self._data is not None else None,
+            self._address + index * size,
+            data=None if self._data is None else memoryview(self._data)[index * size : (index + 1) * size],
         )
-        if content is None:
+        if content is None and (newvarproxy.is_primitive or self._type.kind == "pointer"):
             content = newvarproxy.get_value()
         if newvarproxy.is_primitive:
             return content
@@ -97,10 +134,13 @@ class VarProxy:
                     self._type,
                     self._address + index.start * self._type.size,
                     length=index.stop - index.start,
-                    data=self._data[index.start * self._type.size : index.stop * self._type.size]
-                    if self._data is not None
-                    else None,
+                    data=(
+                        memoryview(self._data)[index.start * self._type.size : index.stop * self._type.size]
+                        if self._data is not None
+                        else None
+                    ),
                 ).get_value()
+            # Structs stay live proxies, see `records` and `snapshot` for decoding at once
             return [self._getitem_single(i) for i in range(index.start, index.stop)]
         else:
             if self._length != -1 and index >= self._length:
@@ -116,6 +156,8 @@ class VarProxy:
         ).set_value(data)
 
     def __setitem__(self, index, data):
+        # Writing invalidates a snapshot
+        self._data = None
         if isinstance(index, slice):
             if self._length == -1:
                 raise TypeError("Sliced access only possible on arrays.")
@@ -132,7 +174,7 @@ class VarProxy:
             return self._setitem_single(index, data)
 
     def get_value(self):
-        content = self.to_bytes()
+        content = self._buffer()
         if self.is_primitive:
             values = []
             for part in chunks(content, self._type.size):
@@ -143,7 +185,7 @@ class VarProxy:
             if len(values) == 1:
                 return values[0]
             return values
-        return content
+        return bytes(content)
 
     def set_value(self, data: Union[list, int, "VarProxy"]):
         if isinstance(data, VarProxy) and self._type.kind == "pointer":
@@ -159,13 +201,90 @@ class VarProxy:
             data.to_bytes(self._type.size, self._backend.endian),
         )
 
-    def to_bytes(self, *args):
+    def dtype(self):
+        """
+        NumPy dtype of the elements in the byte order of the target.
+        Structs have structured dtypes, so that arrays of structs decode into record arrays.
+        """
+        return dtype_of(self._type, self._backend.endian)
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Union[Any, List[Any]]:
+        """
+        Read the elements `start` to `stop` (exclusive, all by default) at once and decode them with a
+        precompiled `struct` codec: Structs into named tuples (nested structs recursively), arrays into lists.
+        """
+        codec = RecordCodec.get(self._type, self._backend.endian)
+        if self._length == -1 and start == 0 and stop is None:
+            return codec.decode(self._buffer())
+        return codec.decode_array(self._elements(start, stop))
+
+    def to_numpy(self, start: int = 0, stop: Optional[int] = None):
+        """Read the elements `start` to `stop` (see `records`) at once as read-only numpy array."""
+        import numpy
+
+        return numpy.frombuffer(self._elements(start, stop), self.dtype())
+
+    def _elements(self, start: int, stop: Optional[int]) -> Union[bytes, memoryview]:
+        """Content of the elements `start` to `stop` (exclusive, negative like slice indices) read at once."""
+        if self._length < 0 and (start != 0 or stop is not None):
+            raise TypeError(f"{self} has no length.")
+        start, stop, _ = slice(start, stop).indices(max(self._length, 1))
+        size = self._type.size
+        if stop <= start:
+            return b""
+        if self._data is not None:
+            return memoryview(self._data)[start * size : stop * size]
+        return self._com.memory_read(self._address + start * size, (stop - start) * size)
+
+    def from_numpy(self, array) -> None:
+        """
+        Write all elements of `array` at once, converted to the element type.
+        Like writing elements one by one, values out of range raise `OverflowError`
+        and non-integer values `TypeError` (instead of wrapping or truncating).
+        """
+        import numpy
+
+        array = numpy.asarray(array)
+        if array.size > max(self._length, 1):
+            raise ValueError(f"Array exceeds length: {array.size} > {max(self._length, 1)}")
+        dtype = self.dtype()
+        if dtype.kind in "iu":
+            # Any integers (`can_cast` would reject signed to unsigned even for values in range)
+            if array.dtype.kind not in "biu":
+                raise TypeError(f"Cannot convert {array.dtype} to {self._type}")
+            info = numpy.iinfo(dtype)
+            if array.size and (array.min() < info.min or array.max() > info.max):
+                raise OverflowError(f"Values out of range of {self._type}")
+        # Writing invalidates a snapshot
+        self._data = None
+        self._com.memory_write(self._address, array.astype(dtype, copy=False).tobytes())
+
+    def snapshot(self) -> "VarProxy":
+        """
+        Read the whole variable at once and return a proxy decoding it locally (including nested
+        structs and arrays). The proxy refers to the same device memory: Writing through it discards
+        the snapshot, so that it reads from the device afterwards. Member and element proxies obtained
+        from it only write to the device, the snapshot (and they themselves) keep the old content.
+        """
+        return self.new2(
+            self._backend, self._com, self._type, self._address, self._length, data=self._buffer()
+        )
+
+    def to_bytes(self, *args) -> bytes:
+        return bytes(self._buffer())
+
+    def _buffer(self) -> Union[bytes, memoryview]:
+        """Local data (without copying) or the content read from the device."""
         if self._data is not None:
             return self._data
         return self._com.memory_read(
             self._address, self._type.size * (self._length if self._length > 0 else 1)
         )
 
+    def __buffer__(self, flags: int) -> memoryview:
+        # Buffer protocol (Python 3.12+), see `LibProxy.buffer`
+        return memoryview(self._buffer())
+
     @property
     def is_primitive(self):
         return self._type.kind == "int"
@@ -192,15 +311,28 @@ class VarProxy:
 
 
 class VarProxyStruct(VarProxy):
+    def _snapshot_data(self) -> Union[None, bytes, memoryview]:
+        """Content of the snapshot or, within `LibProxy.snapshots()`, of the struct read at once."""
+        data = self._data
+        scope = self._com.snapshot_scope
+        if data is None and scope is not None:
+            key = (self._address, self._type.size)
+            if key not in scope:
+                scope[key] = self.to_bytes()
+            data = scope[key]
+        return data
+
     def __getattr__(self, name):
         if name not in self._type.members:
             raise ValueError(f"Unknown member: {name}")
+        data = self._snapshot_data()
         memberoffset, membertype = self._type.members[name]
         memberproxy = VarProxy.new2(
             self._backend,
             self._com,
             membertype,
             self._address + memberoffset,
+            data=None if data is None else memoryview(data)[memberoffset : memberoffset + membertype.size],
         )
         if memberproxy.is_primitive:
             return memberproxy.get_value()
@@ -214,11 +346,13 @@ class VarProxyStruct(VarProxy):
             return memberproxy
 
     def __setattr__(self, name, data):
-        if name in self.__slots__:
+        if name in VarProxy.__slots__:
             return VarProxy.__setattr__(self, name, data)
         if name not in self._type.members:
             raise ValueError(f"Unknown member: {name}")
 
+        # Writing invalidates a snapshot
+        VarProxy.__setattr__(self, "_data", None)
         memberoffset, membertype = self._type.members[name]
         VarProxy.new2(
             self._backend,
@@ -228,10 +362,156 @@ class VarProxyStruct(VarProxy):
         ).set_value(data)
 
 
+def _member_property(name: str, offset: int, type: CType, endian: str) -> property:
+    """Property accessing the integer member `name` with precomputed offset and codec."""
+    char = INT_FORMATS[type.size]
+    codec = struct.Struct(
+        ("<" if endian == "little" else ">") + (char if getattr(type, "signed", False) else char.upper())
+    )
+    size = type.size
+    modulus = 1 << (8 * size)
+
+    def getter(self):
+        data = self._snapshot_data()
+        if data is None:
+            return codec.unpack(self._com.memory_read(self._address + offset, size))[0]
+        return codec.unpack_from(data, offset)[0]
+
+    def setter(self, value):
+        if not isinstance(value, int):
+            return VarProxyStruct.__setattr__(self, name, value)
+        # Writing invalidates a snapshot
+        VarProxy.__setattr__(self, "_data", None)
+        if value < 0:
+            value += modulus
+        self._com.memory_write(self._address + offset, value.to_bytes(size, endian))
+
+    return property(getter, setter, doc=f"{type.typename} {name}")
+
+
+def struct_proxy_class(type: CType) -> Type[VarProxyStruct]:
+    """
+    Return proxy class specialized for struct `type` (created on first use and cached with the type):
+    Integer members are properties with precomputed offsets and codecs, bypassing the generic `__getattr__`.
+    Members named like attributes of `VarProxyStruct` (e.g. `dtype`, `records`) do not replace them.
+    """
+    cls = type.__dict__.get("_proxy_class")
+    if cls is not None:
+        return cls
+    members = getattr(type, "members", None)
+    if members is None:
+        return VarProxyStruct
+    endian = type.backend.endian
+    namespace: Dict[str, Any] = {"__slots__": ()}
+    for name, (offset, membertype) in members.items():
+        if membertype.kind == "int" and membertype.size in INT_FORMATS and not hasattr(VarProxyStruct, name):
+            namespace[name] = _member_property(name, offset, membertype, endian)
+    setters = {name: prop.fset for name, prop in namespace.items() if isinstance(prop, property)}
+
+    def __setattr__(self, name, data):
+        setter = setters.get(name)
+        if setter is None:
+            return VarProxyStruct.__setattr__(self, name, data)
+        setter(self, data)
+
+    namespace["__setattr__"] = __setattr__
+    name = "VarProxyStruct_" + re.sub(r"\W", "_", type.typename)
+    cls = types.new_class(name, (VarProxyStruct,), exec_body=lambda body: body.update(namespace))
+    type.__dict__["_proxy_class"] = cls
+    return cls
+
+
+class CallPlan:
+    """
+    Work of calling a function which only depends on its signature, compiled once per `CTypeFunction`:
+    Converters of the arguments to integers according to the parameter types and decoder of the result.
+    """
+
+    def __init__(self, type: CTypeFunction):
+        # See `FuncProxy._invoke`
+        self.companion_ptr = type.typename.startswith(PYROXENE_COMPANION_PREFIX_PTR)
+        self.numbytes_return = type.return_type.size if type.return_type is not None else 0
+        self.converters = [self._converter(argument) for argument in type.arguments]
+        self.decode = self._decoder(type.return_type)
+
+    @staticmethod
+    def get(type: CTypeFunction) -> "CallPlan":
+        """Return plan of `type`, compiled on first use."""
+        plan = type.__dict__.get("_call_plan")
+        if plan is None:
+            plan = type.__dict__["_call_plan"] = CallPlan(type)
+        return plan
+
+    @staticmethod
+    def _converter(type: CType) -> Callable[[Any], int]:
+        """
+        Return converter of arguments of `type`.
+        Raises `TypeError` (or `AttributeError`) for arguments requiring `FuncProxy.marshal_args`.
+        """
+        if type.kind == "int":
+            # Negative values in two's complement. Types of unknown signedness (enums) accept both ranges.
+            bits = 8 * type.size
+            signed = getattr(type, "signed", None)
+            low = 0 if signed is False else -(1 << (bits - 1))
+            high = 1 << (bits - 1) if signed else 1 << bits
+            mask = (1 << bits) - 1
+
+            def convert_int(arg) -> int:
+                if not low <= arg < high:
+                    raise OverflowError(f"{arg} out of range of {type.typename}")
+                return arg & mask
+
+            return convert_int
+        if type.kind == "pointer":
+
+            def convert_pointer(arg) -> int:
+                if isinstance(arg, VarProxy):
+                    return arg._address
+                return operator.index(arg)
+
+            return convert_pointer
+
+        def unplanned(arg) -> int:
+            raise TypeError(f"No converter for {type}")
+
+        return unplanned
+
+    @staticmethod
+    def _decoder(type: Optional[CType]) -> Callable[["FuncProxy", int], Any]:
+        """Return decoder of results of type `type`."""
+        if type is None:
+            return lambda func, result: None
+        if type.kind == "int" and getattr(type, "signed", False):
+            shift = 8 * type.size - 1
+            wrap = 1 << (8 * type.size)
+            return lambda func, result: result - wrap if result >> shift else result
+        if type.kind == "int":
+            return lambda func, result: result
+        return FuncProxy.unmarshal_returntype
+
+
 class FuncProxy:
     """FuncProxy behaves like a pointer to its type."""
 
-    __slots__ = ("lib", "backend", "com", "type", "address")
+    __slots__ = (
+        "lib",
+        "backend",
+        "com",
+        "type",
+        "address",
+        "plan",
+        "_caller",
+        "inline_bytes_arguments",
+        "snapshot_struct_returns",
+    )
+    # Defaults of the per function settings `inline_bytes_arguments` and `snapshot_struct_returns`:
+    # Carry `bytes` arguments within the call command instead of staging them in device memory.
+    # The device only provides them during the call, so disable for functions retaining these pointers
+    # (e.g. `lib.func.inline_bytes_arguments = False`).
+    default_inline_bytes_arguments = True
+    # Deliver large returned structs within the call response and return them as snapshot (see
+    # `VarProxy.snapshot`), saving the reads of members. Otherwise the proxy reads device memory.
+    default_snapshot_struct_returns = False
 
     def __init__(
         self,
@@ -246,43 +526,288 @@ class FuncProxy:
         self.com = com
         self.type = type
         self.address = address
+        self.plan = CallPlan.get(type)
+        # Communicator and its call compiled for this function, see `Communicator.compile_call`
+        self._caller: Optional[Tuple[Communicator, Callable[[int, List[int]], int]]] = None
+        self.inline_bytes_arguments = self.default_inline_bytes_arguments
+        self.snapshot_struct_returns = self.default_snapshot_struct_returns
 
     def __call__(self, *args):
+        profile = self.lib.profile
+        if profile is None:
+            return self._invoke(*args)
+        memory_commands = self.com.memory_commands
+        start = time.perf_counter()
+        try:
+            return self._invoke(*args)
+        finally:
+            profile.record(
+                self.name,
+                time.perf_counter() - start,
+                sum(len(arg) for arg in args if isinstance(arg, bytes)),
+                self.com.memory_commands - memory_commands,
+            )
+
+    def _invoke(self, *args):
+        plan = self.plan
         # If return value is too large assume different call structure:
         # Instead: bigstruct = func(args)
         # Use: void _pyroxene_ptr_func(bigstruct *, args)
-        if self.type.typename.startswith(PYROXENE_COMPANION_PREFIX_PTR):
-            returnvalue = self.lib.new(self.type.arguments[0])
-            self.com.call(
+        if plan.companion_ptr:
+            returnvalue = self.lib._malloc(self.type.arguments[0])
+            if not self.snapshot_struct_returns:
+                self._call(0, (returnvalue,) + args)
+                return returnvalue
+            response = self._call(0, (returnvalue,) + args, out_length=self.lib.sizeof(returnvalue))
+            returnvalue._data = response.output
+            return returnvalue
+        if len(args) == len(plan.converters) and self.lib.timings is None and self.lib.stack_usage is None:
+            # Plain call, e.g. no bytes to stage
+            try:
+                packed_args = [convert(arg) for convert, arg in zip(plan.converters, args)]
+            except (TypeError, AttributeError):
+                pass
+            else:
+                if self._caller is None or self._caller[0] is not self.com:
+                    self._caller = (self.com, self.com.compile_call(plan.numbytes_return, len(packed_args)))
+                return plan.decode(self, self._caller[1](self.address, packed_args))
+        response = self._call(plan.numbytes_return, args)
+        return plan.decode(self, response.result)
+
+    @property
+    def name(self) -> str:
+        """Name of the function without companion prefix."""
+        for prefix in (PYROXENE_COMPANION_PREFIX_PTR, PYROXENE_COMPANION_PREFIX):
+            if self.type.typename.startswith(prefix):
+                return self.type.typename[len(prefix) :]
+        return self.type.typename
+
+    @property
+    def cycles(self) -> List[int]:
+        """Cycles of all calls recorded in `lib.timings`."""
+        if self.lib.timings is None:
+            return []
+        return self.lib.timings.cycles.get(self.name, [])
+
+    @property
+    def stack_usage(self) -> Optional[int]:
+        """Peak stack usage of all calls recorded in `lib.stack_usage`."""
+        if self.lib.stack_usage is None:
+            return None
+        return self.lib.stack_usage.peak.get(self.name)
+
+    def _call(self, numbytes_return: int, args: tuple, out_length: int = 0) -> CallResult:
+        timings = self.lib.timings
+        cycles = timings is not None
+        stack_usage = self.lib.stack_usage
+        stack_depth = stack_usage.depth if stack_usage is not None else 0
+
+        response = None
+        if self.inline_bytes_arguments and any(isinstance(arg, bytes) for arg in args):
+            buffers: Dict[int, bytes] = {}
+            packed_args = self.marshal_args(*args, buffers=buffers)
+            try:
+                response = self._call_ex(
+                    numbytes_return, packed_args, out_length, buffers, cycles, stack_depth
+                )
+            except BufferError:
+                # Arguments do not fit into a single command
+                pass
+        if response is None:
+            # Keep staged arguments allocated until the call returned
+            temporaries: List[VarProxy] = []
+            packed_args = self.marshal_args(*args, temporaries=temporaries)
+            if out_length or cycles or stack_depth:
+                response = self._call_ex(numbytes_return, packed_args, out_length, None, cycles, stack_depth)
+            else:
+                response = CallResult(self.com.call(self.address, numbytes_return, packed_args))
+
+        if timings is not None and response.cycles is not None:
+            timings.record(self.name, response.cycles)
+        if stack_usage is not None and response.stack is not None:
+            stack_usage.record(self.name, response.stack)
+        return response
+
+    def _call_ex(
+        self,
+        numbytes_return: int,
+        packed_args: List[int],
+        out_length: int,
+        buffers: Optional[Dict[int, bytes]],
+        cycles: bool,
+        stack_depth: int,
+    ) -> CallResult:
+        try:
+            return self.com.call_ex(
                 self.address,
-                0,
-                self.marshal_args(returnvalue, *args),
+                numbytes_return,
+                packed_args,
+                out_length,
+                buffers=buffers,
+                cycles=cycles,
+                stack_depth=stack_depth,
             )
-            return returnvalue
-        result = self.com.call(
-            self.address,
-            self.type.return_type.size if self.type.return_type else 0,
-            self.marshal_args(*args),
-        )
-        if self.type.return_type is not None:
-            return self.unmarshal_returntype(result)
+        except UnsupportedCommand as error:
+            # Call the function without measuring, nothing is recorded
+            warnings.warn(f"{self.name}: {error}", RuntimeWarning, stacklevel=4)
+            return self.com.call_ex(self.address, numbytes_return, packed_args, out_length, buffers=buffers)
 
-    def marshal_args(self, *args) -> List[int]:
-        """Converts all arguments to integers."""
+    def marshal_args(
+        self,
+        *args,
+        buffers: Optional[Dict[int, bytes]] = None,
+        temporaries: Optional[List[VarProxy]] = None,
+    ) -> List[int]:
+        """
+        Converts all arguments to integers.
+        Integers are range checked against integer parameters (`OverflowError`), see `CallPlan`.
+        `bytes` are collected in `buffers` (if given)
+        or staged in device memory and appended to `temporaries`.
+        """
+        arguments = self.type.arguments
         packed_args = []
-        for arg in args:
+        for i, arg in enumerate(args):
             if isinstance(arg, int):
+                if i < len(arguments) and arguments[i].kind == "int":
+                    arg = self.plan.converters[i](arg)
                 packed_args.append(arg)
             elif isinstance(arg, VarProxy):
                 packed_args.append(arg._address)
+            elif isinstance(arg, bytes) and buffers is not None:
+                buffers[i] = arg
+                packed_args.append(0)
             elif isinstance(arg, bytes):
-                var = self.lib.new("uint8_t[]", len(arg))
-                var[0 : len(arg)] = arg
+                # No need to clear memory which is overwritten anyway
+                var = self.lib._malloc("uint8_t[]", len(arg))
+                self.com.memory_write(var._address, arg)
+                if temporaries is not None:
+                    temporaries.append(var)
                 packed_args.append(var._address)
             else:
                 raise ValueError(f"Cannot marshal {arg}")
         return packed_args
 
+    def map(self, arg_tuples: Iterable[tuple]) -> list:
+        """
+        Call function once per tuple of arguments and return the list of results.
+        The arguments are uploaded as table into device memory, the device iterates through it
+        and stores all results in a table which is read at once.
+        Rows are split into batches which fit into device memory. Without device support
+        (see `Communicator.supports_map`) the function is called row by row.
+        """
+        if self.plan.companion_ptr:
+            raise TypeError(f"Cannot map {self.name}: Return value is too large.")
+        rows = [tuple(arg_tuple) for arg_tuple in arg_tuples]
+        if not rows:
+            return []
+        numargs = len(rows[0])
+        if any(len(row) != numargs for row in rows):
+            raise ValueError("All argument tuples must have the same length.")
+
+        if not self.com.supports_map:
+            return [self(*row) for row in rows]
+        sizeof_long = self.com.sizeof_long
+        layout = ("<" if self.backend.endian == "little" else ">") + ("Q" if sizeof_long == 8 else "I")
+
+        results: List[int] = []
+        batchsize = len(rows)
+        # Staged arguments and tables of the current batch, kept allocated until its calls returned
+        temporaries: List[VarProxy] = []
+        try:
+            while len(results) < len(rows):
+                batch = rows[len(results) : len(results) + batchsize]
+                try:
+                    packed_rows = [self.marshal_args(*row, temporaries=temporaries) for row in batch]
+                    # Argument table followed by result table
+                    table = self.lib._malloc("uint8_t[]", len(batch) * (numargs + 1) * sizeof_long)
+                except MemoryError:
+                    # Retry with smaller tables
+                    temporaries.clear()
+                    if batchsize == 1:
+                        raise
+                    batchsize = (batchsize + 1) // 2
+                    continue
+                temporaries.append(table)
+                if numargs > 0:
+                    self.com.memory_write(
+                        table._address,
+                        struct.pack(
+                            f"{layout[0]}{len(batch) * numargs}{layout[1]}", *itertools.chain(*packed_rows)
+                        ),
+                    )
+                resulttable = table._address + len(batch) * numargs * sizeof_long
+                self.com.map(self.address, len(batch), numargs, table._address, resulttable)
+                results += struct.unpack(
+                    f"{layout[0]}{len(batch)}{layout[1]}",
+                    self.com.memory_read(resulttable, len(batch) * sizeof_long),
+                )
+                del table
+                temporaries.clear()
+        finally:
+            temporaries.clear()
+
+        if self.type.return_type is None:
+            return [None] * len(results)
+        return [self.unmarshal_returntype(result) for result in results]
+
+    def stream(
+        self,
+        vectors: Iterable[bytes],
+        max_length: int,
+        output_length: int = 0,
+        arguments: Optional[Callable[[VarProxy, int, Optional[VarProxy]], tuple]] = None,
+    ) -> Iterator[Tuple[Union[None, int, VarProxy], bytes]]:
+        """
+        Call function once per vector and yield its result and `output_length` bytes of output.
+        By default the function is called as `func(input, len(vector), output)` (`output` omitted if
+        `output_length` is 0), `arguments(input, len(vector), output)` may return other arguments.
+
+        Vectors are consumed lazily and uploaded into one of two device buffers of `max_length` bytes:
+        Vector k+1 is sent while vector k is processed, if the communicator supports pipelining.
+        """
+        if self.plan.companion_ptr:
+            raise TypeError(f"Cannot stream {self.name}: Return value is too large.")
+        if arguments is None:
+
+            def arguments(input: VarProxy, length: int, output: Optional[VarProxy]) -> tuple:
+                return (input, length) if output is None else (input, length, output)
+
+        numbytes_return = self.type.return_type.size if self.type.return_type else 0
+        inputs = [self.lib._malloc("uint8_t[]", max(max_length, 1)) for _ in range(2)]
+        outputs: List[Optional[VarProxy]] = [None, None]
+        if output_length:
+            outputs = [self.lib._malloc("uint8_t[]", output_length) for _ in range(2)]
+
+        vectors = iter(vectors)
+        vector = next(vectors, None)
+        with self.com.pipeline() as pipeline:
+            k = 0
+            while vector is not None:
+                if len(vector) > max_length:
+                    raise ValueError(f"Vector exceeds max_length: {len(vector)} > {max_length}")
+                if k == 0:
+                    pipeline.memory_write(inputs[0]._address, vector)
+                # Temporaries of `marshal_args` stay allocated until the response was collected
+                temporaries: List[VarProxy] = []
+                packed_args = self.marshal_args(
+                    *arguments(inputs[k % 2], len(vector), outputs[k % 2]), temporaries=temporaries
+                )
+                result = pipeline.call(self.address, numbytes_return, packed_args)
+                next_vector = next(vectors, None)
+                if next_vector is not None and len(next_vector) <= max_length:
+                    pipeline.memory_write(inputs[(k + 1) % 2]._address, next_vector)
+                output = outputs[k % 2]
+                content = pipeline.memory_read(output._address, output_length) if output is not None else None
+
+                returnvalue = result.result()
+                yield (
+                    self.unmarshal_returntype(returnvalue) if self.type.return_type is not None else None,
+                    content.result() if content is not None else b"",
+                )
+                vector = next_vector
+                k += 1
+                del temporaries
+
     def unmarshal_returntype(self, result: int) -> Union[int, VarProxy]:
         rettype = self.type.return_type
         if rettype.kind == "int":
@@ -314,15 +839,115 @@ class FuncProxy:
         return self.address == other.address
 
 
+class Watcher:
+    """Polls variables with a single gather read per tick and reports changes, see `LibProxy.watch`."""
+
+    def __init__(
+        self,
+        lib: "LibProxy",
+        variables: Iterable[Union[str, VarProxy]],
+        interval: float,
+        max_interval: float,
+        timeout: Optional[float],
+    ):
+        self.lib = lib
+        # Changes are reported by name, or by address for `VarProxy`
+        self.keys: List[Union[str, int]] = []
+        self.variables: List[VarProxy] = []
+        for variable in variables:
+            if isinstance(variable, str):
+                type = lib.backend.types.get(variable)
+                if type is None or type.kind != "variable":
+                    raise TypeError(f"Not a variable: {variable}")
+                self.keys.append(variable)
+                self.variables.append(lib._variable(cast(CTypeVariable, type)))
+            else:
+                self.keys.append(variable._address)
+                self.variables.append(variable)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.delay = interval
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.contents: List[Optional[bytes]] = [None] * len(self.variables)
+
+    def poll(self) -> Dict[Union[str, int], Union[int, list, VarProxy]]:
+        """Read all variables and return the changed ones. Adapt the delay until the next poll."""
+        contents = self.lib.com.gather([(var._address, self.lib.sizeof(var)) for var in self.variables])
+        changes = {}
+        for i, (var, content) in enumerate(zip(self.variables, contents)):
+            if content == self.contents[i]:
+                continue
+            self.contents[i] = content
+            snapshot = VarProxy.new2(
+                var._backend, var._com, var._type, var._address, var._length, data=content
+            )
+            changes[self.keys[i]] = snapshot.get_value() if snapshot.is_primitive else snapshot
+        # Back off while nothing changes
+        self.delay = self.interval if changes else min(2 * self.delay, self.max_interval)
+        return changes
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() + self.delay > self.deadline
+
+
 class LibProxy:
-    def __init__(self, backend: ElfBackend, com: Communicator, memory_manager=None):
+    def __init__(
+        self,
+        backend: ElfBackend,
+        com: Communicator,
+        memory_manager=None,
+        timings: Optional[CallTimings] = None,
+        stack_usage: Optional[StackUsage] = None,
+        profile: Optional[CallProfile] = None,
+    ):
+        # Resolved names, see `__getattr__`
+        self.__dict__["_resolved"] = {}
+        self.__dict__["_generation"] = backend.generation
         self.backend = backend
         self.com = com
         self.memory_manager = memory_manager
+        # If set, the device measures the cycles of all function calls
+        self.timings = timings
+        # If set, the device measures the peak stack usage of all function calls
+        self.stack_usage = stack_usage
+        # If set, calls are profiled on the host
+        self.profile = profile
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "backend":
+            # Cached proxies refer to its types
+            self.__dict__["_resolved"] = {}
+        elif name == "com" and "_resolved" in self.__dict__:
+            # Keep function proxies (and their settings), e.g. when wrapping the communicator
+            for resolved in self._resolved.values():
+                if isinstance(resolved, FuncProxy):
+                    resolved.com = value
 
     def __getattr__(self, name):
-        if name in self.__dict__ or name in dir(self) or name in ("__name__", "__file__"):
-            return super().__getattr__(name)
+        # Only called if `name` is no attribute of LibProxy. Special names are no symbols (e.g. `copy`
+        # probing `__deepcopy__`), other names with leading underscores may be.
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        if self.__dict__["_generation"] != self.backend.generation:
+            # Backend was reloaded
+            self.__dict__["_resolved"] = {}
+            self.__dict__["_generation"] = self.backend.generation
+        resolved = self._resolved.get(name)
+        if resolved is None:
+            resolved = self._resolve(name)
+            self._resolved[name] = resolved
+
+        if isinstance(resolved, FuncProxy):
+            return resolved
+        var = self._variable(resolved)
+        if var.cffi_compatibility_mode and var._length == -1 and var._type.kind == "int":
+            return var[0]
+        return var
+
+    def _resolve(self, name: str) -> Union["FuncProxy", CTypeVariable]:
+        """Return the proxy of function `name` or the type of variable `name`."""
         if name in self.backend.types:
             type = self.backend.types[name]
         elif PYROXENE_COMPANION_PREFIX + name in self.backend.types:
@@ -331,38 +956,36 @@ class LibProxy:
             raise TypeError(f"Unknown type: {name}")
 
         if type.kind == "variable":
-            data = type.data
-            address = type.address
-            if type.type.kind == "array":
-                length = type.type.length
-                type = type.type.base
-            else:
-                type = type.type
-                length = -1
-            var = VarProxy.new2(
-                self.backend,
-                self.com,
-                type,
-                address,
-                length,
-                data=data,
-            )
-            if var.cffi_compatibility_mode and var._length == -1 and var._type.kind == "int":
-                return var[0]
-            return var
+            return cast(CTypeVariable, type)
         if type.kind == "function":
             # Redirect to "_pyroxene_ptr" variant if return argument is too big
-            if getattr(type.return_type, "size", 0) > 8:
+            if getattr(cast(CTypeFunction, type).return_type, "size", 0) > 8:
                 type = self.backend.types[PYROXENE_COMPANION_PREFIX_PTR + name]
             return FuncProxy(
                 self,
                 self.backend,
                 self.com,
-                type,
-                type.address,
+                cast(CTypeFunction, type),
+                cast(CTypeFunction, type).address,
             )
         raise TypeError(f"Neither variable or function: {type}")
 
+    def _variable(self, variable: CTypeVariable) -> VarProxy:
+        """Return proxy of `variable`."""
+        type = variable.type
+        length = -1
+        if type.kind == "array":
+            length = cast(CTypeArray, type).length
+            type = cast(CTypeArray, type).base
+        return VarProxy.new2(
+            self.backend,
+            self.com,
+            type,
+            variable.address,
+            length,
+            data=variable.data,
+        )
+
     def _new(self, type: Union[CType, str], address: int, *args, defer_set=False):
         length = -1
         if isinstance(type, str):
@@ -372,7 +995,7 @@ class LibProxy:
                 type = cast(CTypeArray, type)
                 if type.length > 0:
                     length = type.length
-                elif len(args) == 1 and isinstance(args[0], (list, bytes)):
+                elif len(args) == 1 and (isinstance(args[0], (list, bytes)) or is_ndarray(args[0])):
                     length = len(args[0])
                     type = CTypeArray(type.backend, type.base, length)
                 elif len(args) == 1 and isinstance(args[0], int):
@@ -390,16 +1013,23 @@ class LibProxy:
             return
         if len(args) == 1:
             args = args[0]
-        if var._length != -1:
+        if is_ndarray(args):
+            var.from_numpy(args)
+        elif var._length != -1:
             if isinstance(args, (list, tuple, bytes)):
                 for i, a in enumerate(args):
                     var[i] = a
         else:
             var[0] = args
 
-    def new(self, type: Union[CType, str], *args):
+    def _malloc(self, type: Union[CType, str], *args) -> VarProxy:
+        """Allocate like `new` but leave memory uninitialized."""
         var = self._new(type, 0, *args, defer_set=True)
         self.memory_manager.malloc(var)
+        return var
+
+    def new(self, type: Union[CType, str], *args):
+        var = self._malloc(type, *args)
         self.memset(var._address, 0, self.sizeof(var))
         self._set(var, *args)
 
@@ -423,3 +1053,232 @@ class LibProxy:
 
     def addressof(self, var: VarProxy):
         return var._address
+
+    def buffer(self, var: VarProxy, size: int = -1) -> memoryview:
+        """
+        Read-only view of the first `size` bytes (default: all) of `var` like `ffi.buffer`.
+        Snapshots and constants are viewed without copying, other variables are read once.
+        """
+        view = memoryview(var._buffer()).toreadonly()
+        return view if size == -1 else view[:size]
+
+    def string(self, ptr: Union[VarProxy, int], max_length: int = 4096) -> bytes:
+        """
+        Return the NUL-terminated string `ptr` points to (without NUL) like `ffi.string`,
+        but at most `max_length` bytes (and at most the length of arrays).
+        `ptr` is an address, a `char` proxy (e.g. returned by a function or an array) or a pointer variable.
+        The device determines the length, so that any string is read with a single command.
+        Strings within a loaded segment are read up to its end at most.
+        """
+        if isinstance(ptr, int):
+            address = ptr
+        elif ptr._type.kind == "pointer":
+            address = int.from_bytes(ptr.to_bytes(), self.backend.endian)
+        else:
+            if ptr._length != -1:
+                max_length = min(max_length, self.sizeof(ptr))
+            if ptr._data is not None:
+                content = bytes(ptr._data[:max_length])
+                end = content.find(0)
+                return content if end == -1 else content[:end]
+            address = ptr._address
+        segment_end = self.backend.segment_end(address)
+        if segment_end is not None:
+            # Memory beyond may not be mapped, e.g. for the chunks read by `Communicator.string`
+            max_length = min(max_length, segment_end - address)
+        return self.com.string(address, max_length)
+
+    def from_buffer(
+        self, type: Union[CType, str], buffer: Any = None, address: Optional[int] = None
+    ) -> VarProxy:
+        """
+        Return proxy decoding the content of `buffer` (any object supporting the buffer protocol,
+        e.g. `bytes` or NumPy arrays) as `type` without copying, like `ffi.from_buffer`.
+        The type defaults to "uint8_t[]", arrays without length span the whole buffer.
+        `address` denotes where the content is located on the device, e.g. for writes.
+        Without `address` the proxy is read-only: Writes raise `TypeError`.
+        """
+        if buffer is None:
+            type, buffer = "uint8_t[]", type
+        if isinstance(type, str):
+            type = self.backend.type_from_string(type)
+        type = cast(CType, type)
+        if type.kind not in ("pointer", "array"):
+            raise TypeError("Only pointer or arrays can be created.")
+        data = memoryview(buffer).cast("B")
+        length = -1
+        if type.kind == "array":
+            length = cast(CTypeArray, type).length
+            if length <= 0:
+                length = len(data) // type.base.size  # type: ignore[attr-defined]
+                type = CTypeArray(type.backend, type.base, length)  # type: ignore[attr-defined]
+        if len(data) < type.base.size * max(length, 1):  # type: ignore[attr-defined]
+            raise ValueError(f"Buffer too small for {type}: {len(data)} bytes")
+        if address is None:
+            return VarProxy.new(self.backend, DetachedCommunicator(self.com), type, 0, length, data=data)
+        return VarProxy.new(self.backend, self.com, type, address, length, data=data)
+
+    @contextmanager
+    def snapshots(self) -> Iterator[None]:
+        """
+        Within this context, member access reads the whole struct once and decodes all members locally.
+        Meant for checking several members (e.g. in assertions): The communicator discards the read
+        contents on anything which may modify device memory (writes, calls).
+        """
+        com = self.com
+        outer = com.snapshot_scope
+        if outer is None:
+            com.snapshot_scope = {}
+        try:
+            yield
+        finally:
+            com.snapshot_scope = outer
+
+    def watch(
+        self,
+        *variables: Union[str, VarProxy],
+        interval: float = 0.01,
+        max_interval: float = 1.0,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Dict[Union[str, int], Union[int, list, VarProxy]]]:
+        """
+        Poll `variables` (names or `VarProxy`) and yield their changed values keyed by name (or address).
+        The first poll yields all values. All variables are read with a single command per poll.
+        The interval doubles up to `max_interval` while nothing changes. Polling stops after `timeout`.
+        """
+        watcher = Watcher(self, variables, interval, max_interval, timeout)
+        while True:
+            changes = watcher.poll()
+            if changes:
+                yield changes
+            if watcher.expired:
+                return
+            time.sleep(watcher.delay)
+
+    async def awatch(
+        self,
+        *variables: Union[str, VarProxy],
+        interval: float = 0.01,
+        max_interval: float = 1.0,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Dict[Union[str, int], Union[int, list, VarProxy]]]:
+        """Like `watch`, but as asynchronous iterator."""
+        watcher = Watcher(self, variables, interval, max_interval, timeout)
+        while True:
+            changes = watcher.poll()
+            if changes:
+                yield changes
+            if watcher.expired:
+                return
+            await asyncio.sleep(watcher.delay)
+
+    def gather(self, variables: Iterable[VarProxy]) -> List[VarProxy]:
+        """Read all `variables` with a single gather command and return snapshots of them."""
+        variables = list(variables)
+        contents = self.com.gather([(var._address, self.sizeof(var)) for var in variables])
+        return [
+            var.new2(var._backend, var._com, var._type, var._address, var._length, data=content)
+            for var, content in zip(variables, contents)
+        ]
+
+    def walk(
+        self,
+        start: VarProxy,
+        next: Union[str, Iterable[str]] = "next",
+        limit: Optional[int] = None,
+        prefetch: int = 256,
+    ) -> Iterator[VarProxy]:
+        """
+        Traverse linked structs from `start` (a struct or a pointer to one) along the pointer member(s)
+        `next` and yield snapshots of the reached structs in breadth-first order (at most `limit`).
+        Each level of the traversal is read with a single gather command, structs reached twice are skipped.
+
+        Lists (a single `next` member) are prefetched speculatively: If the structs were laid out with a
+        constant stride, up to `prefetch` of them are read at once, e.g. lists filled from an array.
+        Only memory within the loaded segments of the ELF file is read speculatively.
+        """
+        type = start._type
+        address = start._address
+        if type.kind == "pointer":
+            type = type.base  # type: ignore[attr-defined]
+            address = int.from_bytes(start.to_bytes(), self.backend.endian)
+        members = getattr(type, "members", None)
+        if members is None:
+            raise TypeError(f"Cannot walk {type}: Not a struct.")
+        names = [next] if isinstance(next, str) else list(next)
+        links = []
+        for name in names:
+            if name not in members or members[name][1].kind != "pointer":
+                raise TypeError(f"Cannot walk {type}: {name} is no pointer member.")
+            links.append((members[name][0], members[name][1].size))
+
+        def successors(content: memoryview) -> List[int]:
+            return [
+                int.from_bytes(content[offset : offset + size], self.backend.endian) for offset, size in links
+            ]
+
+        if len(links) == 1:
+            nodes = self._walk_list(type, address, successors, prefetch)
+        else:
+            nodes = self._walk_levels(type, address, successors)
+        return itertools.islice(nodes, limit)
+
+    def _walk_list(
+        self, type: CType, address: int, successors: Callable[[memoryview], List[int]], prefetch: int
+    ) -> Iterator[VarProxy]:
+        size = type.size
+        visited = set()
+        # Stride of the structs seen so far and number of structs to read speculatively
+        stride = 0
+        count = 1
+        while address and address not in visited:
+            end = self.backend.segment_end(address)
+            if stride < size or end is None:
+                count = 1
+            else:
+                count = max(min(count, prefetch, (end - address - size) // stride + 1), 1)
+            content = memoryview(self.com.gather([(address, (count - 1) * stride + size)])[0])
+            for i in range(count):
+                node = content[i * stride : i * stride + size]
+                visited.add(address)
+                yield VarProxy.new2(self.backend, self.com, type, address, data=node)
+                (successor,) = successors(node)
+                if i == count - 1 or successor != address + stride or successor in visited:
+                    break
+                address = successor
+            if successor == address + stride and stride >= size:
+                # Speculation hit: Read more at once
+                count = min(4 * count, prefetch)
+            else:
+                # Follow the layout, unless the struct is located before
+                if successor - address >= size:
+                    stride = successor - address
+                count = max(count // 2, 2)
+            address = successor
+
+    def _walk_levels(
+        self, type: CType, address: int, successors: Callable[[memoryview], List[int]]
+    ) -> Iterator[VarProxy]:
+        visited = {address}
+        level = [address] if address else []
+        while level:
+            nodes = self.gather(VarProxy.new2(self.backend, self.com, type, address) for address in level)
+            level = []
+            for node in nodes:
+                yield node
+                for successor in successors(memoryview(node._data)):
+                    if successor and successor not in visited:
+                        visited.add(successor)
+                        level.append(successor)
+
+    def bench(self, func: FuncProxy, *args, repeat: int = 100) -> BenchResult:
+        """
+        Call `func` `repeat` times in a loop on the device and return min/mean/max cycles per call.
+        All calls use the same arguments.
+        Raises `UnsupportedCommand` unless the communicator talks to the shim.
+        """
+        if func.plan.companion_ptr:
+            returnvalue = self._malloc(func.type.arguments[0])
+            args = (returnvalue,) + args
+        temporaries: List[VarProxy] = []
+        return self.com.bench(func.address, func.marshal_args(*args, temporaries=temporaries), repeat)
@@ -1,11 +1,13 @@
 import logging
+import mmap
 import re
-from typing import Dict, Literal, Optional, Type
+from typing import Dict, List, Literal, Optional, Tuple, Type
 
 from elftools.dwarf.dwarfinfo import DWARFInfo  # type: ignore[import]
 from elftools.dwarf.dwarf_expr import DW_OP_opcode2name  # type: ignore[import]
 from elftools.dwarf.descriptions import _DESCR_DW_ATE  # type: ignore[import]
 from elftools.dwarf.die import DIE  # type: ignore[import]
+from elftools.elf.constants import SH_FLAGS  # type: ignore[import]
 from elftools.elf.elffile import ELFFile  # type: ignore[import]
 
 logger = logging.getLogger(__name__)
@@ -473,6 +475,11 @@ class ElfBackend:
     ):
         self.types: Dict[str, CType] = {}
         self.enums: Dict[str, int] = {}
+        # Incremented whenever types are (re)created, e.g. to invalidate caches
+        self.generation = 0
+        # Memory-mapped ELF file and views of its read-only sections, see `read_only_regions`
+        self._image: Optional[mmap.mmap] = None
+        self._regions: Optional[List[Tuple[int, memoryview]]] = None
         self.types["void"] = CTypeBaseType(self, "void", 0)
         self._create(file, compilation_unit_filter)
         self.types["NULL"] = CTypeVariable(self, "NULL", 0, self.type_from_string("void *"), 0)
@@ -527,11 +534,31 @@ class ElfBackend:
         file: str,
         compilation_unit_filter=lambda _: True,
     ):
+        self.generation += 1
+        # Views handed out keep the previous mapping alive
+        self._image = None
+        self._regions = None
+        self.file = file
         with open(file, "rb") as fp:
             self.elffile: ELFFile = ELFFile(fp)
             self.dwarfinfo: DWARFInfo = self.elffile.get_dwarf_info()
             self.endian: Literal["little", "big"] = "little" if self.dwarfinfo.config.little_endian else "big"
             self.sizeof_voidp: int = self.dwarfinfo.config.default_address_size
+            # Memory of the target occupied by the loaded segments as [start, end)
+            self.segments: List[Tuple[int, int]] = [
+                (segment["p_vaddr"], segment["p_vaddr"] + segment["p_memsz"])
+                for segment in self.elffile.iter_segments(type="PT_LOAD")
+                if segment["p_vaddr"] is not None
+            ]
+            # Sections loaded into the target which are never written as (address, file offset, size)
+            self.read_only_sections: List[Tuple[int, int, int]] = [
+                (section["sh_addr"], section["sh_offset"], section["sh_size"])
+                for section in self.elffile.iter_sections()
+                if section["sh_flags"] & SH_FLAGS.SHF_ALLOC
+                and not section["sh_flags"] & SH_FLAGS.SHF_WRITE
+                and section["sh_type"] != "SHT_NOBITS"
+                and section["sh_size"] > 0
+            ]
             for cu in self.dwarfinfo.iter_CUs():
                 cuname = cu.get_top_DIE().attributes["DW_AT_name"].value.decode()
                 if not compilation_unit_filter(cuname):
@@ -593,3 +620,37 @@ class ElfBackend:
             offset = location - segment["p_vaddr"]
             if offset >= 0 and location + size <= segment["p_vaddr"] + segment["p_filesz"]:
                 return segment.data()[offset : offset + size]
+
+    def segment_end(self, location: int) -> Optional[int]:
+        """End of the loaded segment containing `location` (None if not within a segment)."""
+        for start, end in self.segments:
+            if start <= location < end:
+                return end
+        return None
+
+    def read_only_regions(self) -> List[Tuple[int, memoryview]]:
+        """
+        Contents of all read-only sections (e.g. `.text`, `.rodata`) as (address, content).
+        The contents are views of the ELF file, mapped into memory once and unmapped by `close`.
+        """
+        if self._regions is None:
+            with open(self.file, "rb") as fp:
+                self._image = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            with memoryview(self._image) as image:
+                self._regions = [
+                    (address, image[offset : offset + size])
+                    for address, offset, size in self.read_only_sections
+                ]
+        return self._regions
+
+    def close(self) -> None:
+        """
+        Unmap the ELF file: The views returned by `read_only_regions` cannot be used anymore.
+        Without calling it, the mapping lives as long as any of these views.
+        """
+        for _, content in self._regions or []:
+            content.release()
+        self._regions = None
+        if self._image is not None:
+            self._image.close()
+            self._image = None
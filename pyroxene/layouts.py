@@ -0,0 +1,118 @@
+"""Layouts of C types compiled for decoding many values at once."""
+
+import keyword
+import re
+import struct
+from collections import namedtuple
+from typing import Any, Callable, Iterator, List, Tuple, Union, cast
+
+from .elfbackend import CType, CTypeArray
+
+INT_FORMATS = {1: "b", 2: "h", 4: "i", 8: "q"}
+FLOAT_FORMATS = {4: "f", 8: "d"}
+
+
+def array_layout(type: CType) -> Tuple[CType, int]:
+    """Return element type and length of an array (or typedef of an array)."""
+    while not hasattr(type, "length"):
+        type = type.base  # type: ignore[attr-defined]
+    type = cast(CTypeArray, type)
+    return type.base, type.length
+
+
+def struct_members(type: CType) -> List[Tuple[str, int, CType]]:
+    """Return (name, offset, type) of all members ordered by offset."""
+    members = getattr(type, "members", {})
+    return sorted(((name, offset, member) for name, (offset, member) in members.items()), key=lambda m: m[1])
+
+
+def dtype_of(type: CType, endian: str):
+    """
+    Return NumPy dtype of `type`: Structs become structured dtypes (with offsets and padding of the target),
+    arrays subarrays, pointers unsigned integers and unions opaque bytes.
+    """
+    import numpy
+
+    order = "<" if endian == "little" else ">"
+    if type.kind == "int" and type.size in INT_FORMATS:
+        return numpy.dtype(f"{order}{'i' if getattr(type, 'signed', False) else 'u'}{type.size}")
+    if type.kind == "pointer" and type.size in INT_FORMATS:
+        return numpy.dtype(f"{order}u{type.size}")
+    if type.kind == "float" and type.size in FLOAT_FORMATS:
+        return numpy.dtype(f"{order}f{type.size}")
+    if type.kind == "array":
+        base, length = array_layout(type)
+        return numpy.dtype((dtype_of(base, endian), (length,)))
+    if type.kind == "struct":
+        members = struct_members(type)
+        return numpy.dtype(
+            {
+                "names": [name for name, _, _ in members],
+                "formats": [dtype_of(member, endian) for _, _, member in members],
+                "offsets": [offset for _, offset, _ in members],
+                "itemsize": type.size,
+            }
+        )
+    if type.kind == "union":
+        return numpy.dtype(f"V{type.size}")
+    raise TypeError(f"No dtype for {type}")
+
+
+class RecordCodec:
+    """
+    Precompiled `struct.Struct` decoding values of `type`.
+    Structs are decoded into named tuples (nested structs recursively), arrays into lists.
+    """
+
+    def __init__(self, type: CType, endian: str):
+        self.type = type
+        fmt, self.build = self._compile(type)
+        self.struct = struct.Struct(("<" if endian == "little" else ">") + fmt)
+
+    @staticmethod
+    def get(type: CType, endian: str) -> "RecordCodec":
+        """Return codec of `type`, compiled on first use."""
+        codecs = type.__dict__.setdefault("_record_codecs", {})
+        if endian not in codecs:
+            codecs[endian] = RecordCodec(type, endian)
+        return codecs[endian]
+
+    def _compile(self, type: CType) -> Tuple[str, Callable[[Iterator[Any]], Any]]:
+        """Return format (spanning `type.size` bytes) and builder of the value from the unpacked fields."""
+        if type.kind == "int" and type.size in INT_FORMATS:
+            char = INT_FORMATS[type.size]
+            return (char if getattr(type, "signed", False) else char.upper()), next
+        if type.kind == "pointer" and type.size in INT_FORMATS:
+            return INT_FORMATS[type.size].upper(), next
+        if type.kind == "float" and type.size in FLOAT_FORMATS:
+            return FLOAT_FORMATS[type.size], next
+        if type.kind == "array":
+            base, length = array_layout(type)
+            fmt, build = self._compile(base)
+            return fmt * length, lambda fields: [build(fields) for _ in range(length)]
+        if type.kind == "struct":
+            fmt = ""
+            position = 0
+            builders = []
+            for _, offset, member in struct_members(type):
+                memberfmt, build = self._compile(member)
+                fmt += "x" * (offset - position) + memberfmt
+                position = offset + member.size
+                builders.append(build)
+            fmt += "x" * (type.size - position)
+            name = re.sub(r"\W", "_", type.typename.replace("struct ", ""))
+            record = namedtuple(  # type: ignore[misc]
+                name if name.isidentifier() and not keyword.iskeyword(name) and name != "_" else "record",
+                [name for name, _, _ in struct_members(type)],
+                rename=True,
+            )
+            return fmt, lambda fields: record(*(build(fields) for build in builders))
+        if type.kind == "union":
+            return f"{type.size}s", next
+        raise TypeError(f"Cannot decode {type}")
+
+    def decode(self, data: Union[bytes, memoryview], offset: int = 0) -> Any:
+        return self.build(iter(self.struct.unpack_from(data, offset)))
+
+    def decode_array(self, data: Union[bytes, memoryview]) -> List[Any]:
+        return [self.build(iter(fields)) for fields in self.struct.iter_unpack(data)]
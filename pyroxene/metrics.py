@@ -0,0 +1,134 @@
+from collections import defaultdict
+from typing import Dict, List, Tuple, Union, cast
+import json
+import marshal
+import math
+
+
+class CallTimings:
+    """Collects the cycles the device spent in function calls."""
+
+    def __init__(self):
+        self.cycles: Dict[str, List[int]] = defaultdict(list)
+
+    def record(self, function: str, cycles: int) -> None:
+        self.cycles[function].append(cycles)
+
+    def report(self) -> str:
+        """Return table of all recorded functions sorted by total cycles."""
+        lines = [f"{'function':<40} {'calls':>8} {'min':>12} {'mean':>12} {'max':>12} {'total':>14}"]
+        for function, cycles in sorted(self.cycles.items(), key=lambda entry: -sum(entry[1])):
+            lines.append(
+                f"{function:<40} {len(cycles):>8} {min(cycles):>12} {sum(cycles) // len(cycles):>12} "
+                f"{max(cycles):>12} {sum(cycles):>14}"
+            )
+        return "\n".join(lines)
+
+
+class StackUsage:
+    """
+    Collects the peak stack usage of function calls.
+    Before each call the device paints `depth` bytes of stack, so `depth` must not exceed the free stack.
+    """
+
+    def __init__(self, depth: int = 1024):
+        self.depth = depth
+        self.peak: Dict[str, int] = {}
+
+    def record(self, function: str, stack: int) -> None:
+        self.peak[function] = max(self.peak.get(function, 0), stack)
+
+    def report(self) -> str:
+        """Return table of all recorded functions sorted by peak stack usage."""
+        lines = [f"{'function':<40} {'stack':>8}"]
+        for function, stack in sorted(self.peak.items(), key=lambda entry: -entry[1]):
+            lines.append(f"{function:<40} {stack:>8}")
+        return "\n".join(lines)
+
+    def save(self, path: str) -> None:
+        """Store peak stack usage as JSON, e.g. as baseline for `regressions`."""
+        with open(path, "w") as fp:
+            json.dump(self.peak, fp, indent=2, sort_keys=True)
+
+    def regressions(
+        self, baseline: Union[str, Dict[str, int]], tolerance: int = 0
+    ) -> Dict[str, Tuple[int, int]]:
+        """
+        Compare with `baseline` (stored with `save` or a dictionary).
+        Return functions using more than `tolerance` bytes of stack above baseline as (baseline, peak).
+        """
+        if isinstance(baseline, str):
+            with open(baseline) as fp:
+                baseline = cast(Dict[str, int], json.load(fp))
+        return {
+            function: (baseline[function], stack)
+            for function, stack in self.peak.items()
+            if function in baseline and stack > baseline[function] + tolerance
+        }
+
+
+class FunctionProfile:
+    """Statistics of the calls of a single function, see `CallProfile`."""
+
+    def __init__(self):
+        # Host latency in seconds
+        self.latencies: List[float] = []
+        self.staged_bytes = 0
+        self.memory_commands = 0
+
+    @property
+    def calls(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def total(self) -> float:
+        return sum(self.latencies)
+
+    def percentile(self, percent: float) -> float:
+        """Latency not exceeded by `percent` percent of the calls (nearest rank)."""
+        latencies = sorted(self.latencies)
+        return latencies[max(0, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+
+class CallProfile:
+    """
+    Collects host latency, bytes of staged arguments and memory commands of function calls.
+    Memory commands are the protocol commands accessing memory (see `Communicator.memory_commands`).
+    """
+
+    sort_keys = ("total", "calls", "staged_bytes", "memory_commands")
+
+    def __init__(self):
+        self.functions: Dict[str, FunctionProfile] = defaultdict(FunctionProfile)
+
+    def record(self, function: str, latency: float, staged_bytes: int = 0, memory_commands: int = 0) -> None:
+        profile = self.functions[function]
+        profile.latencies.append(latency)
+        profile.staged_bytes += staged_bytes
+        profile.memory_commands += memory_commands
+
+    def report(self, sort: str = "total") -> str:
+        """Return table of all recorded functions sorted by `sort` (one of `sort_keys`), latencies in µs."""
+        if sort not in self.sort_keys:
+            raise ValueError(f"Cannot sort by {sort}, use one of {self.sort_keys}")
+        lines = [
+            f"{'function':<40} {'calls':>8} {'total':>12} {'mean':>10} {'p50':>10} {'p95':>10} {'max':>10} "
+            f"{'staged':>10} {'memcmds':>8}"
+        ]
+        for function, profile in sorted(self.functions.items(), key=lambda entry: -getattr(entry[1], sort)):
+            lines.append(
+                f"{function:<40} {profile.calls:>8} {profile.total * 1e6:>12.0f} "
+                f"{profile.total / profile.calls * 1e6:>10.1f} {profile.percentile(50) * 1e6:>10.1f} "
+                f"{profile.percentile(95) * 1e6:>10.1f} {max(profile.latencies) * 1e6:>10.1f} "
+                f"{profile.staged_bytes:>10} {profile.memory_commands:>8}"
+            )
+        return "\n".join(lines)
+
+    def dump_stats(self, path: str, filename: str = "<device>") -> None:
+        """Store the latencies in the format of `cProfile`, e.g. for `pstats.Stats(path)` or snakeviz."""
+        stats: Dict[Tuple[str, int, str], tuple] = {
+            (filename, 0, function): (profile.calls, profile.calls, profile.total, profile.total, {})
+            for function, profile in self.functions.items()
+        }
+        with open(path, "wb") as fp:
+            marshal.dump(stats, fp)
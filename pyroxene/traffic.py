@@ -0,0 +1,196 @@
+import os
+import traceback
+from collections import Counter
+from typing import List, NamedTuple, Optional, Tuple
+
+from .device_commands import BenchResult, CallResult, Communicator, CommunicatorWrapper, Pipeline
+
+# Frames within pyroxene are skipped when locating accesses
+PYROXENE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Access(NamedTuple):
+    # "read", "write" or "call"
+    kind: str
+    addr: int = 0
+    size: int = 0
+    stack: Optional[traceback.StackSummary] = None
+
+    @property
+    def end(self) -> int:
+        return self.addr + self.size
+
+    @property
+    def location(self) -> str:
+        """Innermost frame outside of pyroxene which caused the access."""
+        if not self.stack:
+            return "<unknown>"
+        frame = self.stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+
+class Finding(NamedTuple):
+    # "duplicate read", "dead write" or "member-wise read"
+    kind: str
+    description: str
+    access: Access
+
+
+def subtract(intervals: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """Remove [start, end) from the list of half-open intervals."""
+    result = []
+    for a, b in intervals:
+        if b <= start or a >= end:
+            result.append((a, b))
+            continue
+        if a < start:
+            result.append((a, start))
+        if b > end:
+            result.append((end, b))
+    return result
+
+
+class TracingCommunicator(CommunicatorWrapper):
+    """
+    Records all memory accesses and calls with the Python stack causing them.
+    `findings` analyzes the trace for redundant traffic:
+
+    - duplicate read: Memory is read again, but neither written nor modified by a call since the last read.
+    - dead write: Memory is overwritten completely before it is read or used by a call.
+    - member-wise read: At least `member_run` small reads of adjacent memory (e.g. members of a struct)
+      which could be a single read.
+    """
+
+    member_run = 3
+
+    def __init__(self, communicator: Communicator, stack_depth: int = 8):
+        super().__init__(communicator)
+        self.stack_depth = stack_depth
+        self.trace: List[Access] = []
+
+    def _record(self, kind: str, addr: int = 0, size: int = 0) -> None:
+        stack = traceback.StackSummary.from_list(
+            [
+                frame
+                for frame in traceback.extract_stack(limit=self.stack_depth + 8)
+                if not os.path.abspath(frame.filename).startswith(PYROXENE_DIR + os.sep)
+            ][-self.stack_depth :]
+        )
+        self.trace.append(Access(kind, addr, size, stack))
+
+    def memory_read(self, addr: int, size: int) -> bytes:
+        self._record("read", addr, size)
+        return super().memory_read(addr, size)
+
+    def memory_write(self, addr: int, data: bytes) -> None:
+        self._record("write", addr, len(data))
+        super().memory_write(addr, data)
+
+    def call(self, addr: int, numbytes_return: int, args: List[int]) -> int:
+        self._record("call", addr)
+        return super().call(addr, numbytes_return, args)
+
+    def call_ex(self, *args, **kwargs) -> CallResult:
+        self._record("call", args[0])
+        return super().call_ex(*args, **kwargs)
+
+    def bench(self, addr: int, args: List[int], repeat: int) -> BenchResult:
+        self._record("call", addr)
+        return super().bench(addr, args, repeat)
+
+    def map(self, addr: int, rows: int, numargs: int, table: int, results: int) -> None:
+        self._record("call", addr)
+        return super().map(addr, rows, numargs, table, results)
+
+    def gather(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        for addr, size in ranges:
+            self._record("read", addr, size)
+        return super().gather(ranges)
+
+    def string(self, addr: int, max_length: int) -> bytes:
+        result = super().string(addr, max_length)
+        self._record("read", addr, len(result))
+        return result
+
+    def pipeline(self) -> Pipeline:
+        # Issue every command through this wrapper to record it
+        return Communicator.pipeline(self)
+
+    def clear(self) -> None:
+        self.trace = []
+
+    def findings(self) -> List[Finding]:
+        findings = []
+        # Memory read since the last call and not written since
+        valid: List[Tuple[int, int]] = []
+        # Writes not used yet with their bytes not overwritten yet
+        pending: List[Tuple[Access, List[Tuple[int, int]]]] = []
+        # Adjacent reads
+        run: List[Access] = []
+
+        def close_run():
+            if len(run) >= self.member_run:
+                findings.append(
+                    Finding(
+                        "member-wise read",
+                        f"{len(run)} reads of adjacent memory 0x{run[0].addr:08x}..0x{run[-1].end:08x} "
+                        f"could be a single read of {run[-1].end - run[0].addr} bytes",
+                        run[0],
+                    )
+                )
+            run.clear()
+
+        for access in self.trace:
+            if access.size == 0 and access.kind != "call":
+                continue
+            if access.kind == "call":
+                # The device may read and modify any memory
+                valid = []
+                pending = []
+                close_run()
+            elif access.kind == "read":
+                if run and not (0 <= access.addr - run[-1].end < self.sizeof_long and access.size <= 8):
+                    close_run()
+                if access.size <= 8:
+                    run.append(access)
+                if any(a <= access.addr and access.end <= b for a, b in valid):
+                    findings.append(
+                        Finding(
+                            "duplicate read",
+                            f"0x{access.addr:08x} ({access.size} bytes) was read before, unmodified since",
+                            access,
+                        )
+                    )
+                valid.append((access.addr, access.end))
+                pending = [
+                    (write, remaining)
+                    for write, remaining in pending
+                    if not any(a < access.end and access.addr < b for a, b in remaining)
+                ]
+            else:
+                valid = subtract(valid, access.addr, access.end)
+                still_pending = []
+                for write, remaining in pending:
+                    remaining = subtract(remaining, access.addr, access.end)
+                    if remaining:
+                        still_pending.append((write, remaining))
+                    else:
+                        findings.append(
+                            Finding(
+                                "dead write",
+                                f"0x{write.addr:08x} ({write.size} bytes) is overwritten before it is used",
+                                write,
+                            )
+                        )
+                pending = still_pending + [(access, [(access.addr, access.end)])]
+                close_run()
+        close_run()
+        return findings
+
+    def report(self) -> str:
+        """Return findings grouped by kind and location, sorted by count."""
+        counts = Counter((finding.kind, finding.access.location) for finding in self.findings())
+        lines = [f"{'count':>6} {'kind':<18} location"]
+        for (kind, location), count in counts.most_common():
+            lines.append(f"{count:>6} {kind:<18} {location}")
+        return "\n".join(lines)
@@ -1,37 +1,45 @@
 // Server side C/C++ program to demonstrate Socket
 // programming
+//
+// Usage: host_test [tcp:<port>|unix:<path>]
+//   Without argument the dispatcher listens on TCP port 9999 (127.0.0.1).
+//   "tcp:<port>" selects another port, "tcp:0" an ephemeral one.
+//   "unix:<path>" listens on a Unix domain socket at <path> instead.
+//
+// Once listening, the address is announced on stdout as
+//   "pyroxene: listening on tcp:<port>" or "pyroxene: listening on unix:<path>".
+// Every accepted connection is served by a forked, isolated copy of this process.
 #include <arpa/inet.h>
+#include <errno.h>
 #include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <signal.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/prctl.h>
 #include <sys/socket.h>
+#include <sys/un.h>
 #include <unistd.h>
 
 #include "pyroxene.h"
 
 int pyroxenesocket = 0;
 int server_fd = 0;
+const char *unix_path = NULL;
+uint16_t tcp_port = 9999;
+// Process id of the copy serving the connection, e.g. for direct access to its memory
+pid_t pyroxene_host_pid = 0;
 uint8_t socket_buffer[16 * 1024] = { 0 };
 
-static void socket_connect(void)
+static void socket_listen_tcp(void)
 {
-
     struct sockaddr_in address;
+    socklen_t addrlen = sizeof(address);
     int opt = 1;
-    int addrlen = sizeof(address);
-
-    if (pyroxenesocket != 0)
-    {
-        close(pyroxenesocket);
-    }
-    if (server_fd != 0)
-    {
-        shutdown(server_fd, SHUT_RDWR);
-    }
 
     // Creating socket file descriptor
-    if ((server_fd = socket(AF_INET, SOCK_STREAM, 0)) == 0)
+    if ((server_fd = socket(AF_INET, SOCK_STREAM, 0)) < 0)
     {
         perror("socket failed");
         exit(EXIT_FAILURE);
@@ -46,7 +54,7 @@ static void socket_connect(void)
     }
     address.sin_family = AF_INET;
     address.sin_addr.s_addr = inet_addr("127.0.0.1");
-    address.sin_port = htons(9999);
+    address.sin_port = htons(tcp_port);
 
     // Forcefully attaching socket
     if (bind(server_fd, (struct sockaddr *)&address, sizeof(address)) < 0)
@@ -54,22 +62,130 @@ static void socket_connect(void)
         perror("bind failed");
         exit(EXIT_FAILURE);
     }
-    if (listen(server_fd, 1) < 0)
+
+    // Resolve ephemeral port
+    if (getsockname(server_fd, (struct sockaddr *)&address, &addrlen) < 0)
     {
-        perror("listen");
+        perror("getsockname");
         exit(EXIT_FAILURE);
     }
+    tcp_port = ntohs(address.sin_port);
+}
+
+static void socket_listen_unix(void)
+{
+    struct sockaddr_un address = { 0 };
+
+    if ((server_fd = socket(AF_UNIX, SOCK_STREAM, 0)) < 0)
+    {
+        perror("socket failed");
+        exit(EXIT_FAILURE);
+    }
+    if (strlen(unix_path) >= sizeof(address.sun_path))
+    {
+        fprintf(stderr, "socket path too long: %s\n", unix_path);
+        exit(EXIT_FAILURE);
+    }
+    address.sun_family = AF_UNIX;
+    strcpy(address.sun_path, unix_path);
+
+    // Remove stale socket file of a previous run
+    unlink(unix_path);
+    if (bind(server_fd, (struct sockaddr *)&address, sizeof(address)) < 0)
+    {
+        perror("bind failed");
+        exit(EXIT_FAILURE);
+    }
+}
+
+static void socket_listen(void)
+{
+    if (unix_path != NULL)
+    {
+        socket_listen_unix();
+    }
+    else
+    {
+        socket_listen_tcp();
+    }
 
-    if ((pyroxenesocket = accept(server_fd, (struct sockaddr *)&address, (socklen_t *)&addrlen)) < 0)
+    if (listen(server_fd, 16) < 0)
     {
-        perror("accept");
+        perror("listen");
         exit(EXIT_FAILURE);
     }
+
+    if (unix_path != NULL)
+    {
+        printf("pyroxene: listening on unix:%s\n", unix_path);
+    }
+    else
+    {
+        printf("pyroxene: listening on tcp:%u\n", tcp_port);
+    }
+    fflush(stdout);
+}
+
+static void socket_accept(void)
+{
+    // Children are not waited for
+    signal(SIGCHLD, SIG_IGN);
+
+    while (1)
+    {
+        if ((pyroxenesocket = accept(server_fd, NULL, NULL)) < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            perror("accept");
+            exit(EXIT_FAILURE);
+        }
+
+        pid_t pid = fork();
+        if (pid < 0)
+        {
+            perror("fork");
+            exit(EXIT_FAILURE);
+        }
+        if (pid == 0)
+        {
+            // Child: Serve this connection with a pristine copy of the process
+            prctl(PR_SET_PDEATHSIG, SIGTERM);
+            close(server_fd);
+            pyroxene_host_pid = getpid();
+            break;
+        }
+        close(pyroxenesocket);
+    }
+
+    if (unix_path == NULL)
+    {
+        // Responses are written in several small portions ("ACK", then data).
+        // Disable Nagle so that they do not wait for the (delayed) ACK of the host.
+        int opt = 1;
+        if (setsockopt(pyroxenesocket, IPPROTO_TCP, TCP_NODELAY, &opt, sizeof(opt)))
+        {
+            perror("setsockopt");
+            exit(EXIT_FAILURE);
+        }
+    }
 }
 
 int main(int argc, char const *argv[])
 {
-    socket_connect();
+    if (argc > 1 && strncmp(argv[1], "unix:", 5) == 0)
+    {
+        unix_path = &argv[1][5];
+    }
+    else if (argc > 1 && strncmp(argv[1], "tcp:", 4) == 0)
+    {
+        tcp_port = (uint16_t)atoi(&argv[1][4]);
+    }
+
+    socket_listen();
+    socket_accept();
 
     pyroxene_dispatcher();
 
@@ -78,17 +194,38 @@ int main(int argc, char const *argv[])
 
 void pyroxene_read(uint8_t *buffer, size_t length)
 {
-    ssize_t bytesread = read(pyroxenesocket, &buffer[bytesread], length - bytesread);
-
-    if (bytesread == 0)
+    size_t bytesread = 0;
+    while (bytesread < length)
     {
-        // Socket was closed, reconnect
-        socket_connect();
-        ssize_t bytesread = read(pyroxenesocket, &buffer[bytesread], length - bytesread);
+        ssize_t result = read(pyroxenesocket, &buffer[bytesread], length - bytesread);
+        if (result < 0 && errno == EINTR)
+        {
+            continue;
+        }
+        if (result <= 0)
+        {
+            // Socket was closed, this copy of the process is done
+            exit(EXIT_SUCCESS);
+        }
+        bytesread += (size_t)result;
     }
 }
 
 void pyroxene_write(const uint8_t *buffer, size_t length)
 {
-    (void)!write(pyroxenesocket, buffer, length);
+    size_t byteswritten = 0;
+    while (byteswritten < length)
+    {
+        ssize_t result = write(pyroxenesocket, &buffer[byteswritten], length - byteswritten);
+        if (result < 0 && errno == EINTR)
+        {
+            continue;
+        }
+        if (result <= 0)
+        {
+            // Connection is broken, the response is lost
+            return;
+        }
+        byteswritten += (size_t)result;
+    }
 }
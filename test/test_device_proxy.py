@@ -1,7 +1,7 @@
 import unittest
 from pyroxene.device_commands import CommunicatorStub
 
-from pyroxene.device_proxy import VarProxy, VarProxyStruct
+from pyroxene.device_proxy import VarProxy, VarProxyStruct, struct_proxy_class
 
 from .test_elfbackend import compile
 
@@ -138,6 +138,49 @@ class TestDeviceProxyGcc(unittest.TestCase):
         var.y = var2
         self.assertEqual(var.y._address, var2._address)
 
+    def test_proxy_struct_class(self):
+        elf = compile(
+            """
+            #include <stdint.h>
+            struct a {
+                int16_t x;
+                uint8_t flag;
+                uint32_t *p;
+                uint64_t values[2];
+                uint8_t dtype;
+                uint8_t records;
+                uint8_t _data;
+            } a_;
+            """,
+            cmdline=self.compiler_cmdline,
+        )
+        type = elf.type_from_string("struct a")
+        cls = struct_proxy_class(type)
+        self.assertIs(struct_proxy_class(type), cls)
+        self.assertTrue(issubclass(cls, VarProxyStruct))
+        self.assertIsInstance(cls.__dict__["x"], property)
+        self.assertNotIn("values", cls.__dict__)
+
+        com = CommunicatorStub()
+        var = VarProxy.new(elf, com, elf.type_from_string("struct a *"), 0x100)
+        self.assertIsInstance(var, cls)
+        var.x = -2
+        var.flag = 0xFF
+        self.assertEqual((var.x, var.flag), (-2, 0xFF))
+        self.assertEqual(com.memory[0x100], 0xFE)
+        self.assertEqual(var.values, [0, 0])
+        with self.assertRaises(OverflowError):
+            var.flag = 0x100
+        with self.assertRaises(ValueError):
+            var.unknown = 1
+
+        # Members do not shadow proxy attributes
+        for name in ("dtype", "records", "_data"):
+            self.assertNotIn(name, cls.__dict__)
+        var.records = 7
+        self.assertEqual(var.records().records, 7)
+        self.assertEqual(var.snapshot().x, -2)
+
 
 class TestDeviceProxyGccArm(TestDeviceProxyGcc):
     compiler_cmdline = "arm-none-eabi-gcc -c -g {infile} -o {outfile}"
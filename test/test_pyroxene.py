@@ -1,23 +1,45 @@
 from contextlib import contextmanager
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import asyncio
+import gc
+import hashlib
 import os
+import pstats
 import signal
+import socket
 import subprocess
-import time
+import threading
 import unittest
 
-from pyroxene.device_commands import PyroxeneSocketCommunicator
-from pyroxene.device_proxy import LibProxy, VarProxy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyroxene.device_commands import (
+    Communicator,
+    CountingCommunicator,
+    ProcessMemoryCommunicator,
+    PyroxenePipeline,
+    PyroxeneSerialCommunicator,
+    PyroxeneSocketCommunicator,
+    PyroxeneUnixSocketCommunicator,
+    ReadOnlyMemoryCommunicator,
+    UnsupportedCommand,
+)
+from pyroxene.device_proxy import FuncProxy, LibProxy, VarProxy
 from pyroxene.elfbackend import ElfBackend
 from pyroxene.memory_management import SimpleMemoryManager
+from pyroxene.metrics import CallProfile, CallTimings, StackUsage
+from pyroxene.traffic import TracingCommunicator
 from pyroxene.companion_generator import CompanionCodeGenerator, generate_companion
 
 
 @contextmanager
-def compile(source: str, print_output=False) -> LibProxy:
+def compile(source: str, print_output=False, unix_socket=False, process_memory=False) -> LibProxy:
     root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     with TemporaryDirectory() as tmpdir:
-        tmpdir = "."
         with open(os.path.join(tmpdir, "src.c"), "w") as fp:
             fp.write(source)
 
@@ -35,13 +57,19 @@ def compile(source: str, print_output=False) -> LibProxy:
                 ).decode()
             )
         backend = ElfBackend(os.path.join(tmpdir, "prog"))
-        p = subprocess.Popen("./prog", cwd=tmpdir)
-        time.sleep(0.1)  # Wait til prog started. TODO: Is there a smarter solution?
+        # Listen on an ephemeral port (or private socket) so that tests may run in parallel
+        address = f"unix:{os.path.join(tmpdir, 'prog.sock')}" if unix_socket else "tcp:0"
+        p = subprocess.Popen(["./prog", address], cwd=tmpdir, stdout=subprocess.PIPE)
         try:
-            yield LibProxy(
-                backend,
-                PyroxeneSocketCommunicator(("localhost", 9999), backend.sizeof_voidp),
+            com = PyroxeneSocketCommunicator.connect_announced(
+                p.stdout, backend.sizeof_voidp, native_byteorder=True
             )
+            # Drain further output, the target would block on a full pipe otherwise
+            threading.Thread(target=p.stdout.read, daemon=True).start()
+            lib = LibProxy(backend, com)
+            if process_memory:
+                lib.com = ProcessMemoryCommunicator(lib.pyroxene_host_pid, com)
+            yield lib
         except:  # noqa: E722 do not use bare except
             p.send_signal(signal.SIGTERM)
             p.wait(1)
@@ -216,3 +244,983 @@ class TestPyroxene(unittest.TestCase):
 
             var = lib.new("uint32_t *", lib.init32())
             self.assertEqual(var[0], 42)
+
+    def test_unix_socket(self):
+        with compile(
+            """
+            #include <stdint.h>
+            int func(int a) { return 1 + a; }
+            """,
+            unix_socket=True,
+        ) as lib:
+            self.assertIsInstance(lib.com, PyroxeneUnixSocketCommunicator)
+            self.assertEqual(lib.com.echo(b"hello"), b"hello")
+            self.assertEqual(lib.func(41), 42)
+
+            lib.pyroxene_memory[0:4] = [1, 2, 3, 4]
+            self.assertEqual(lib.pyroxene_memory[0:4], [1, 2, 3, 4])
+
+            path = lib.com.sock.getpeername()
+            com2 = PyroxeneSocketCommunicator.connect_announced(
+                [f"pyroxene: listening on unix:{path}"], lib.backend.sizeof_voidp, nodelay=False
+            )
+            self.assertIsInstance(com2, PyroxeneUnixSocketCommunicator)
+            self.assertEqual(com2.echo(b"hello"), b"hello")
+
+            # A failed connection is cleaned up without errors
+            with patch("sys.unraisablehook") as unraisablehook:
+                with self.assertRaises(FileNotFoundError):
+                    PyroxeneUnixSocketCommunicator(path + ".missing", lib.backend.sizeof_voidp)
+                gc.collect()
+            unraisablehook.assert_not_called()
+
+    def test_process_memory(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint32_t value;
+            uint32_t get_value(void) { return value; }
+            void set_value(uint32_t x) { value = x; }
+            """,
+            process_memory=True,
+        ) as lib:
+            self.assertIsInstance(lib.com, ProcessMemoryCommunicator)
+            self.assertIsNotNone(lib.com.fd)
+            self.assertEqual(lib.com.echo(b"hello"), b"hello")
+
+            value = lib._new("uint32_t *", lib.backend.types["value"].address)
+            value[0] = 42
+            self.assertEqual(lib.get_value(), 42)
+            lib.set_value(7)
+            self.assertEqual(lib.value, 7)
+
+            lib.pyroxene_memory[0:4096] = 4096 * [0xA5]
+            self.assertEqual(lib.pyroxene_memory[0:4096], 4096 * [0xA5])
+
+            # Fall back to protocol if process memory is not accessible
+            lib.com.close()
+            value[0] = 43
+            self.assertEqual(lib.get_value(), 43)
+            self.assertEqual(lib.value, 43)
+
+    def test_connection_per_process(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint32_t value;
+            """,
+        ) as lib:
+            com2 = PyroxeneSocketCommunicator(lib.com.sock.getpeername(), lib.backend.sizeof_voidp)
+            lib2 = LibProxy(lib.backend, com2)
+            self.assertNotEqual(lib.pyroxene_host_pid, lib2.pyroxene_host_pid)
+
+            # Both connections are served by isolated copies of the target
+            lib.pyroxene_memory[0:4] = [1, 2, 3, 4]
+            lib2.pyroxene_memory[0:4] = [5, 6, 7, 8]
+            self.assertEqual(lib.pyroxene_memory[0:4], [1, 2, 3, 4])
+            self.assertEqual(lib2.pyroxene_memory[0:4], [5, 6, 7, 8])
+
+    def test_byteorder(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint64_t func(uint64_t a, uint64_t b) { return a - b; }
+            """,
+        ) as lib:
+            self.assertEqual(lib.com.byteorder, lib.backend.endian)
+
+            # Network byte order unless negotiated
+            com2 = PyroxeneSocketCommunicator(lib.com.sock.getpeername(), lib.backend.sizeof_voidp)
+            self.assertEqual(com2.byteorder, "big")
+            lib2 = LibProxy(lib.backend, com2)
+
+            for lib_ in (lib, lib2):
+                self.assertEqual(lib_.func(0x0102030405060708, 0x0101010101010101), 0x0001020304050607)
+                lib_.pyroxene_memory[0:4] = [1, 2, 3, 4]
+                self.assertEqual(lib_.pyroxene_memory[0:4], [1, 2, 3, 4])
+
+    def test_serial_byteorder(self):
+        class SocketSerial:
+            """Serial port lookalike on top of a connection that outlives the communicators."""
+
+            def __init__(self, sock):
+                self.sock = sock
+                self.timeout = None
+
+            def read(self, length):
+                self.sock.settimeout(self.timeout)
+                data = b""
+                try:
+                    while len(data) < length:
+                        chunk = self.sock.recv(length - len(data))
+                        if not chunk:
+                            break
+                        data += chunk
+                except socket.timeout:
+                    pass
+                return data
+
+            def read_all(self):
+                self.sock.settimeout(0)
+                data = b""
+                try:
+                    while True:
+                        chunk = self.sock.recv(4096)
+                        if not chunk:
+                            break
+                        data += chunk
+                except BlockingIOError:
+                    pass
+                return data
+
+            def write(self, data):
+                self.sock.sendall(data)
+
+        with compile(
+            """
+            #include <stdint.h>
+            uint64_t func(uint64_t a, uint64_t b) { return a - b; }
+            """,
+        ) as lib:
+            sock = socket.create_connection(lib.com.sock.getpeername())
+            try:
+                with patch("serial.Serial", lambda port, baud: SocketSerial(sock)), patch("time.sleep"):
+                    # A later session without negotiation must not inherit the native byte order
+                    for native in (True, False):
+                        com = PyroxeneSerialCommunicator(
+                            None, 0, lib.backend.sizeof_voidp, initial_timeout=1.0, native_byteorder=native
+                        )
+                        self.assertEqual(com.byteorder, lib.backend.endian if native else "big")
+                        lib2 = LibProxy(lib.backend, com)
+                        self.assertEqual(lib2.func(0x0102030405060708, 0x0101010101010101), 0x01020304050607)
+            finally:
+                sock.close()
+
+    def test_struct_return_snapshot(self):
+        src = """
+            #include <stdint.h>
+            typedef struct {
+                uint32_t a;
+                uint32_t b[2];
+                uint8_t *c;
+            } b_t;
+            uint8_t data[2] = { 42, 43 };
+            inline b_t func(uint32_t a, uint32_t b) { b_t x = { a, { a + b, a - b }, data }; return x; }
+            void modify(b_t *x) { x->a += 1; }
+        """
+        gen = CompanionCodeGenerator([], [], [], inline_src=src)
+        gen.preprocess()
+        src += generate_companion(gen)
+        with compile(src) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            # Returned structs are located in device memory
+            result = lib.func(5, 3)
+            self.assertIsNone(result._data)
+            lib.modify(result)
+            self.assertEqual(result.a, 6)
+            self.assertEqual(list(result.b), [8, 2])
+
+            lib.func.snapshot_struct_returns = True
+            result = lib.func(5, 3)
+            self.assertEqual(result._data[:4], (5).to_bytes(4, lib.backend.endian))
+
+            # Members are decoded from the snapshot
+            read = lib.com.memory_read
+            lib.com.memory_read = None
+            self.assertEqual(result.a, 5)
+            self.assertEqual(list(result.b), [8, 2])
+            lib.com.memory_read = read
+            self.assertEqual(result.c[0:2], [42, 43])
+
+            # Result is located in device memory and writing invalidates the snapshot
+            result.a = 7
+            self.assertIsNone(result._data)
+            self.assertEqual(result.a, 7)
+            self.assertEqual(result.b[1], 2)
+
+    def test_bytes_arguments(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <string.h>
+            uint32_t sum(const uint8_t *a, uint32_t alen, const uint8_t *b, uint32_t blen) {
+                uint32_t result = 0;
+                for (uint32_t i = 0; i < alen; i++) result += a[i];
+                for (uint32_t i = 0; i < blen; i++) result += 2 * b[i];
+                return result;
+            }
+            uint32_t is_aligned(const uint64_t *a) { return ((uintptr_t)a % sizeof(long)) == 0; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+
+            # Small buffers are carried within the call command
+            write = lib.com.memory_write
+            lib.com.memory_write = None
+            self.assertEqual(lib.sum(b"abc", 3, b"\x01", 1), ord("a") + ord("b") + ord("c") + 2)
+            self.assertEqual(lib.is_aligned(b"\x01"), 1)
+            self.assertEqual(lib.sum(b"", 0, bytes(range(100)), 100), 2 * sum(range(100)))
+            lib.com.memory_write = write
+
+            # Large buffers are staged in device memory
+            data = bytes(range(256)) * 8
+            self.assertEqual(lib.sum(data, len(data), data, len(data)), 3 * sum(data))
+
+            # Opt out per function, e.g. for functions retaining the pointers
+            lib.sum.inline_bytes_arguments = False
+            lib.com = CountingCommunicator(lib.com)
+            self.assertEqual(lib.sum(b"abc", 3, b"\x01", 1), ord("a") + ord("b") + ord("c") + 2)
+            self.assertEqual(lib.com.commands["memory_write"], 2)
+            self.assertEqual(lib.is_aligned(b"\x01"), 1)
+            self.assertEqual(lib.com.commands["memory_write"], 2)
+            with patch.object(FuncProxy, "default_inline_bytes_arguments", False):
+                func = FuncProxy(lib, lib.backend, lib.com, lib.sum.type, lib.sum.address)
+            self.assertFalse(func.inline_bytes_arguments)
+
+    def test_call_timings(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint32_t loop(uint32_t n) {
+                volatile uint32_t x = 0;
+                for (uint32_t i = 0; i < n; i++) x += i;
+                return x;
+            }
+            """,
+        ) as lib:
+            self.assertEqual(lib.loop.cycles, [])
+            lib.timings = CallTimings()
+            self.assertEqual(lib.loop(10), 45)
+            self.assertEqual(lib.loop(10000), sum(range(10000)))
+            cycles = lib.loop.cycles
+            self.assertEqual(len(cycles), 2)
+            self.assertLess(cycles[0], cycles[1])
+            self.assertIn("loop", lib.timings.report())
+
+            # Communicators without the extended call still call, but do not measure
+            with patch.object(type(lib.com), "call_ex", Communicator.call_ex):
+                with self.assertWarns(RuntimeWarning):
+                    self.assertEqual(lib.loop(10), 45)
+            self.assertEqual(len(lib.loop.cycles), 2)
+
+    def test_bench(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint32_t loop(uint32_t n) {
+                volatile uint32_t x = 0;
+                for (uint32_t i = 0; i < n; i++) x += i;
+                return x;
+            }
+            uint32_t counter;
+            void count(void) { counter++; }
+            """,
+        ) as lib:
+            result = lib.bench(lib.loop, 10, repeat=10)
+            self.assertLessEqual(result.min, result.mean)
+            self.assertLessEqual(result.mean, result.max)
+            self.assertLess(result.mean, lib.bench(lib.loop, 10000, repeat=10).mean)
+
+            lib.bench(lib.count, repeat=1000)
+            self.assertEqual(lib.counter, 1000)
+            self.assertEqual(lib.bench(lib.count, repeat=0), (0, 0, 0))
+
+            with patch.object(type(lib.com), "bench", Communicator.bench):
+                with self.assertRaises(UnsupportedCommand):
+                    lib.bench(lib.count, repeat=10)
+            self.assertEqual(lib.counter, 1000)
+
+    def test_map(self):
+        with compile(
+            """
+            #include <stdint.h>
+            int32_t sub(int32_t a, int32_t b) { return a - b; }
+            uint32_t first(const uint8_t *data) { return data[0]; }
+            uint32_t counter;
+            void count(void) { counter++; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            rows = [(i, 2 * i + 1) for i in range(1000)]
+            self.assertEqual(lib.sub.map(rows), [a - b for a, b in rows])
+            self.assertEqual(lib.sub.map([]), [])
+            self.assertEqual(lib.first.map([(b"a",), (b"b",)]), [ord("a"), ord("b")])
+            self.assertEqual(lib.count.map([()] * 10), [None] * 10)
+            self.assertEqual(lib.counter, 10)
+
+            # Staged arguments exceeding device memory are split into batches
+            rows = [(bytes([i]) * 900,) for i in range(10)]
+            self.assertEqual(lib.first.map(rows), list(range(10)))
+            self.assertEqual(lib.first.map(rows), list(range(10)))
+
+            with patch.object(type(lib.com), "supports_map", False):
+                self.assertEqual(lib.sub.map([(5, 3), (1, 2)]), [2, -1])
+                self.assertEqual(lib.count.map([()] * 5), [None] * 5)
+            self.assertEqual(lib.counter, 15)
+
+    def test_stream(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <stddef.h>
+            uint32_t checksum(const uint8_t *data, size_t length, uint8_t *reversed)
+            {
+                uint32_t sum = 0;
+                for (size_t i = 0; i < length; i++)
+                {
+                    sum += data[i];
+                    reversed[length - 1 - i] = data[i];
+                }
+                return sum;
+            }
+            uint32_t sum(const uint8_t *data, size_t length, uint32_t start)
+            {
+                while (length--) start += *data++;
+                return start;
+            }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            vectors = (bytes([i % 256]) * 900 + bytes(range(i % 48)) for i in range(100))
+            expected = (bytes([i % 256]) * 900 + bytes(range(i % 48)) for i in range(100))
+            for (result, output), vector in zip(lib.checksum.stream(vectors, 960, 960), expected):
+                self.assertEqual(result, sum(vector))
+                self.assertEqual(output[: len(vector)], vector[::-1])
+
+            results = lib.sum.stream(
+                [b"\x01\x02", b"", b"\x03"], 2, arguments=lambda input, length, output: (input, length, 100)
+            )
+            self.assertEqual(list(results), [(103, b""), (100, b""), (103, b"")])
+            with self.assertRaises(ValueError):
+                list(lib.sum.stream([b"\x01\x02\x03"], 2))
+
+            # Wrappers keep pipelining unless they observe every command
+            com = lib.com
+            lib.com = ProcessMemoryCommunicator(lib.pyroxene_host_pid, com)
+            with lib.com.pipeline() as pipeline:
+                self.assertIsInstance(pipeline, PyroxenePipeline)
+            with CountingCommunicator(com).pipeline() as pipeline:
+                self.assertNotIsInstance(pipeline, PyroxenePipeline)
+            results = lib.sum.stream(
+                [b"\x01\x02", b"\x03"], 2, arguments=lambda input, length, output: (input, length, 1)
+            )
+            self.assertEqual(list(results), [(4, b""), (4, b"")])
+
+    def test_stack_usage(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <string.h>
+            uint32_t shallow(uint32_t a) { return a + 1; }
+            __attribute__((noinline)) uint32_t deep(uint32_t n)
+            {
+                volatile uint8_t buffer[512];
+                memset((uint8_t *)buffer, (int)n, sizeof(buffer));
+                return buffer[n % sizeof(buffer)];
+            }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            lib.stack_usage = StackUsage(depth=4096)
+            self.assertEqual(lib.shallow(1), 2)
+            self.assertEqual(lib.deep(3), 3)
+            self.assertEqual(lib.deep(4), 4)
+            self.assertLess(lib.shallow.stack_usage, 128)
+            self.assertGreaterEqual(lib.deep.stack_usage, 512)
+            self.assertLess(lib.deep.stack_usage, 1024)
+            self.assertEqual(lib.stack_usage.report().splitlines()[1].split()[0], "deep")
+
+            with TemporaryDirectory() as tmpdir:
+                baseline = os.path.join(tmpdir, "stack.json")
+                lib.stack_usage.save(baseline)
+                self.assertEqual(lib.stack_usage.regressions(baseline), {})
+                self.assertEqual(
+                    lib.stack_usage.regressions({"deep": 100, "unknown": 0}),
+                    {"deep": (100, lib.deep.stack_usage)},
+                )
+
+            # Communicators without the extended call still call, but do not measure
+            with patch.object(type(lib.com), "call_ex", Communicator.call_ex):
+                with self.assertWarns(RuntimeWarning):
+                    self.assertEqual(lib.shallow(5), 6)
+            self.assertLess(lib.shallow.stack_usage, 128)
+
+    def test_call_profile(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <stddef.h>
+            uint32_t add(uint32_t a, uint32_t b) { return a + b; }
+            uint32_t first(const uint8_t *data, size_t length) { return length ? data[0] : 0; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            # Protocol commands are counted without wrapping the communicator
+            lib.profile = CallProfile()
+            for i in range(10):
+                self.assertEqual(lib.add(i, 1), i + 1)
+            self.assertEqual(lib.first(b"\x05" * 10, 10), 5)
+            # Too large for the command: staged in device memory
+            self.assertEqual(lib.first(b"\x07" * 2000, 2000), 7)
+
+            self.assertEqual(lib.profile.functions["add"].calls, 10)
+            self.assertEqual(lib.profile.functions["add"].memory_commands, 0)
+            self.assertEqual(lib.profile.functions["first"].staged_bytes, 2010)
+            # 2000 bytes need two write commands
+            self.assertEqual(lib.profile.functions["first"].memory_commands, 2)
+            self.assertEqual(lib.com.commands["call_ex"], 1)
+
+            # Writes split into several commands count per command
+            counting = CountingCommunicator(lib.com)
+            counting.memory_write(lib.pyroxene_memory._address, bytes(3000))
+            self.assertEqual(counting.commands["memory_write"], 3)
+            self.assertEqual(counting.bytes_written, 3000)
+            self.assertEqual(counting.memory_commands, 3)
+            self.assertEqual(lib.profile.report(sort="calls").splitlines()[1].split()[:2], ["add", "10"])
+            with self.assertRaises(ValueError):
+                lib.profile.report(sort="unknown")
+
+            with TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "device.prof")
+                lib.profile.dump_stats(path)
+                stats = pstats.Stats(path)
+                self.assertEqual(stats.stats[("<device>", 0, "add")][:2], (10, 10))
+
+    def test_traffic_analysis(self):
+        with compile(
+            """
+            #include <stdint.h>
+            struct point { uint32_t x; uint32_t y; uint32_t z; };
+            void move(struct point *p) { p->x++; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            lib.com = TracingCommunicator(lib.com)
+            point = lib.new("struct point *")  # memset is overwritten by the members
+            point.x, point.y, point.z = 1, 2, 3
+            self.assertEqual((point.x, point.y, point.z), (1, 2, 3))  # member by member
+            self.assertEqual(point.x, 1)  # read before
+            lib.move(point)
+            self.assertEqual(point.x, 2)
+
+            findings = lib.com.findings()
+            self.assertEqual(
+                [finding.kind for finding in findings], ["dead write", "member-wise read", "duplicate read"]
+            )
+            self.assertEqual(findings[0].access.addr, point._address)
+            self.assertEqual(findings[0].access.stack[-1].name, "test_traffic_analysis")
+            self.assertIn("could be a single read of 12 bytes", findings[1].description)
+            self.assertIn(__file__, lib.com.report())
+
+            lib.com.clear()
+            self.assertEqual(lib.com.findings(), [])
+
+            # Only frames within the package are skipped, not those of directories sharing its prefix
+            with patch("pyroxene.traffic.PYROXENE_DIR", os.path.dirname(os.path.abspath(__file__))[:-1]):
+                self.assertEqual(point.y, 2)
+            self.assertIn("test_traffic_analysis", [frame.name for frame in lib.com.trace[-1].stack])
+
+    def test_watch(self):
+        with compile(
+            """
+            #include <stdint.h>
+            struct point { uint32_t x; uint32_t y; };
+            uint32_t counter;
+            uint8_t state;
+            struct point position;
+            uint8_t table[256];
+            void tick(void) { counter++; position.x += 2; }
+            void finish(void) { state = 3; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            ranges = [(lib.table._address + i, 1) for i in range(100)]
+            lib.table[0:100] = list(range(100))
+            self.assertEqual(lib.com.gather(ranges), [bytes([i]) for i in range(100)])
+            self.assertEqual(lib.com.gather([]), [])
+
+            watch = lib.watch("counter", "state", lib.position, interval=0.001, timeout=1.0)
+            first = next(watch)
+            self.assertEqual((first["counter"], first["state"]), (0, 0))
+            self.assertEqual(first[lib.position._address].x, 0)
+            lib.tick()
+            change = next(watch)
+            self.assertEqual(list(change), ["counter", lib.position._address])
+            self.assertEqual(change["counter"], 1)
+            self.assertEqual(change[lib.position._address].x, 2)
+            lib.finish()
+            self.assertEqual(next(watch), {"state": 3})
+            # Nothing changes anymore until timeout
+            self.assertEqual(list(watch), [])
+            with self.assertRaises(TypeError):
+                next(lib.watch("tick"))
+
+            async def first_change():
+                async for change in lib.awatch("counter", interval=0.001, timeout=1.0):
+                    return change
+
+            self.assertEqual(asyncio.run(first_change()), {"counter": 1})
+
+    def test_snapshot(self):
+        with compile(
+            """
+            #include <stdint.h>
+            struct inner { uint16_t values[3]; uint8_t flag; };
+            struct outer { uint32_t a; struct inner inner; uint32_t b; };
+            struct outer result = { 1, { { 2, 3, 4 }, 5 }, 6 };
+            void update(void) { result.a = 10; }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            lib.com = CountingCommunicator(lib.com)
+
+            snapshot = lib.result.snapshot()
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+            self.assertEqual(snapshot.a, 1)
+            self.assertEqual(snapshot.inner.values[2], 4)
+            self.assertEqual(list(snapshot.inner.values), [2, 3, 4])
+            self.assertEqual(snapshot.inner.flag, 5)
+            self.assertEqual(snapshot.b, 6)
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+
+            # Writing through the snapshot discards it, writing through member proxies does not
+            snapshot.inner.flag = 9
+            self.assertEqual(snapshot.inner.flag, 5)
+            self.assertEqual(lib.result.inner.flag, 9)
+            snapshot.b = 8
+            self.assertEqual((snapshot.inner.flag, snapshot.b), (9, 8))
+            snapshot = lib.result.snapshot()
+            snapshot.inner.flag = 5
+            lib.result.b = 6
+            self.assertEqual(lib.com.commands["memory_read"], 5)
+
+            # Automatic mode: one read per struct until a write or call
+            with lib.snapshots():
+                self.assertEqual((lib.result.a, lib.result.inner.flag, lib.result.b), (1, 5, 6))
+                self.assertEqual(lib.com.commands["memory_read"], 6)
+                lib.update()
+                self.assertEqual(lib.result.a, 10)
+                lib.result.b = 7
+                self.assertEqual(lib.result.b, 7)
+                self.assertEqual(lib.com.commands["memory_read"], 8)
+                # Any write through the communicator discards the contents
+                lib.memset(lib.result, 0, 4)
+                self.assertEqual(lib.result.a, 0)
+                lib.com.communicator.memory_write(lib.result._address, (11).to_bytes(4, "little"))
+                self.assertEqual(lib.result.a, 11)
+                self.assertEqual(lib.com.commands["memory_read"], 10)
+            self.assertIsNone(lib.com.snapshot_scope)
+            lib.result.a = 10
+            self.assertEqual(snapshot.a, 1)
+            self.assertEqual(lib.result.a, 10)
+            self.assertEqual(lib.com.commands["memory_read"], 11)
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_numpy(self):
+        with compile(
+            """
+            #include <stdint.h>
+            int16_t samples[1000];
+            uint32_t total(const uint32_t *values, uint32_t count)
+            {
+                uint32_t sum = 0;
+                while (count--) sum += *values++;
+                return sum;
+            }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            values = numpy.arange(-500, 500, dtype=numpy.int64)
+            lib.samples.from_numpy(values)
+            self.assertEqual(lib.samples.dtype(), numpy.dtype("i2").newbyteorder(lib.backend.endian[0]))
+            self.assertTrue((lib.samples.to_numpy() == values).all())
+            self.assertEqual(lib.samples[0:3], [-500, -499, -498])
+            with self.assertRaises(ValueError):
+                lib.samples.from_numpy(numpy.zeros(1001))
+
+            var = lib.new("uint32_t[]", numpy.arange(100, dtype=numpy.uint32))
+            self.assertEqual(len(var), 100)
+            self.assertEqual(lib.total(var, 100), sum(range(100)))
+            self.assertEqual(list(var.to_numpy()[98:]), [98, 99])
+
+            # Values are not wrapped or truncated
+            with self.assertRaises(OverflowError):
+                lib.samples.from_numpy(numpy.array([1, 40000]))
+            with self.assertRaises(TypeError):
+                lib.samples.from_numpy(numpy.array([2.7]))
+            with self.assertRaises(OverflowError):
+                lib.new("uint8_t[]", numpy.array([256, 1]))
+            with self.assertRaises(OverflowError):
+                lib.new("uint8_t[]", numpy.array([-1]))
+            self.assertEqual(lib.samples[0:2], [-500, -499])
+            lib.samples.from_numpy(numpy.array([-32768, 32767], dtype=numpy.int32))
+            self.assertEqual(lib.samples[0:2], [-32768, 32767])
+
+    def test_struct_arrays(self):
+        with compile(
+            """
+            #include <stdint.h>
+            struct inner { uint16_t x; uint8_t *p; };
+            struct entry { uint8_t id; int32_t values[2]; struct inner inner; };
+            struct entry table[50];
+            void fill(void)
+            {
+                for (int i = 0; i < 50; i++)
+                {
+                    table[i].id = (uint8_t)i;
+                    table[i].values[0] = -i;
+                    table[i].values[1] = i * 1000;
+                    table[i].inner.x = (uint16_t)(i + 1);
+                    table[i].inner.p = &table[i].id;
+                }
+            }
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            lib.fill()
+            lib.com = CountingCommunicator(lib.com)
+
+            # Slices and iteration stay live
+            entries = lib.table[10:20]
+            self.assertEqual(lib.com.commands["memory_read"], 0)
+            self.assertEqual([entry.id for entry in entries], list(range(10, 20)))
+            self.assertEqual(entries[3].values[0], -13)
+            self.assertEqual(entries[3].inner.x, 14)
+            self.assertEqual(entries[3].inner.p._address, lib.table._address + 13 * lib.table._type.size)
+            entries[3].inner.x = 99
+            self.assertEqual(lib.table[13].inner.x, 99)
+            lib.fill()
+            self.assertEqual(entries[3].inner.x, 14)
+            self.assertEqual([entry.id for entry in lib.table][-3:], [47, 48, 49])
+
+            # Decoding at once
+            lib.com.commands.clear()
+            records = lib.table.records()
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+            self.assertEqual(len(records), 50)
+            self.assertEqual(records[7].id, 7)
+            self.assertEqual(records[7].values, [-7, 7000])
+            self.assertEqual(records[7].inner.x, 8)
+            self.assertEqual(lib.table[49:50][0].inner.x, 50)
+            self.assertEqual(lib.new("int32_t *", -5).records(), -5)
+
+            # Decoding a range at once
+            lib.com.commands.clear()
+            bytes_read = lib.com.bytes_read
+            records = lib.table.records(10, 20)
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+            self.assertEqual(lib.com.bytes_read - bytes_read, 10 * lib.table._type.size)
+            self.assertEqual([record.id for record in records], list(range(10, 20)))
+            self.assertEqual(records[3].inner.x, 14)
+            self.assertEqual([record.id for record in lib.table.records(-2)], [48, 49])
+            self.assertEqual(lib.table.records(5, 5), [])
+            self.assertEqual([record.id for record in lib.table.snapshot().records(1, 3)], [1, 2])
+
+            if numpy is not None:
+                array = lib.table.to_numpy()
+                self.assertEqual(list(array["id"][:3]), [0, 1, 2])
+                self.assertEqual(list(array["values"][5]), [-5, 5000])
+                self.assertEqual(array["inner"]["x"][9], 10)
+                lib.com.commands.clear()
+                array = lib.table.to_numpy(40, 45)
+                self.assertEqual(lib.com.commands["memory_read"], 1)
+                self.assertEqual(list(array["id"]), [40, 41, 42, 43, 44])
+
+    def test_attribute_cache(self):
+        with compile(
+            """
+            #include <stdint.h>
+            uint32_t counter;
+            uint32_t increment(uint32_t a) { counter += a; return counter; }
+            uint32_t __reserved(void) { return 42; }
+            """,
+        ) as lib:
+            self.assertIs(lib.increment, lib.increment)
+            self.assertEqual(lib.increment(3), 3)
+            self.assertEqual(lib.counter, 3)
+            with self.assertRaises(TypeError):
+                lib.unknown
+            with self.assertRaises(AttributeError):
+                lib.__wrapped__
+            self.assertEqual(getattr(lib, "__reserved")(), 42)
+
+            # Cached proxies follow the communicator ...
+            increment = lib.increment
+            lib.com = CountingCommunicator(lib.com)
+            self.assertIs(lib.increment, increment)
+            self.assertIs(lib.increment.com, lib.com)
+            self.assertEqual(lib.increment(1), 4)
+            self.assertEqual(lib.com.commands["call"] + lib.com.commands["call_ex"], 1)
+
+            # ... and are dropped if the backend is replaced
+            increment = lib.increment
+            lib.backend = ElfBackend(lib.backend.elffile.stream.name)
+            self.assertIsNot(lib.increment, increment)
+            self.assertIs(lib.increment.backend, lib.backend)
+            self.assertEqual(lib.increment(1), 5)
+
+    def test_call_plan(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <stddef.h>
+            int32_t sub(int32_t a, int8_t b) { return a - b; }
+            uint16_t first(const uint16_t *values) { return values[0]; }
+            size_t length(const uint8_t *data, size_t len) { return len + (data[0] == 'a'); }
+            void nothing(void) {}
+            """,
+        ) as lib:
+            lib.memory_manager = SimpleMemoryManager(lib)
+            self.assertEqual(lib.sub(-5, -3), -2)
+            self.assertEqual(lib.sub(3, 5), -2)
+            values = lib.new("uint16_t[]", [0xFFFF, 2])
+            self.assertEqual(lib.first(values), 0xFFFF)
+            self.assertEqual(lib.first(values._address + 2), 2)
+            self.assertIsNone(lib.nothing())
+            # Arguments without converter take the generic path
+            self.assertEqual(lib.length(b"abc", 3), 4)
+            with self.assertRaises(ValueError):
+                lib.first(1.0)
+
+            # Integers out of range of the parameter type are rejected on both paths
+            for args in ((1, 128), (1, -129), (1 << 31, 0)):
+                with self.assertRaises(OverflowError):
+                    lib.sub(*args)
+            self.assertEqual(lib.sub(-(1 << 31), -128), -(1 << 31) + 128)
+            with self.assertRaises(OverflowError):
+                lib.length(b"abc", -1)
+            lib.timings = CallTimings()
+            with self.assertRaises(OverflowError):
+                lib.sub(1, 128)
+            self.assertEqual(lib.sub(-5, -3), -2)
+            lib.timings = None
+
+            # Compiled calls follow a renegotiated byte order
+            self.assertEqual(lib.sub(7, 2), 5)
+            lib.com.negotiate_byteorder(native=False)
+            self.assertEqual(lib.sub(7, 2), 5)
+            lib.com.negotiate_byteorder(native=True)
+            self.assertEqual(lib.sub(-7, 2), -9)
+
+            # The compiled call goes through all wrapping communicators
+            lib.com = CountingCommunicator(lib.com)
+            self.assertEqual(lib.sub(1, 2), -1)
+            self.assertEqual(lib.com.commands["call"], 1)
+
+    def test_buffers(self):
+        with compile(
+            """
+            #include <stdint.h>
+            struct point { uint16_t x; int16_t y; };
+            const uint16_t table[512] = { 1, 2, 3, [511] = 0xBEEF };
+            struct point points[4] = { { 1, -1 }, { 2, -2 }, { 3, -3 }, { 4, -4 } };
+            """,
+        ) as lib:
+            lib.com = CountingCommunicator(lib.com)
+            # Constants are indexed from local data
+            self.assertEqual([lib.table[i] for i in (0, 2, 511)], [1, 3, 0xBEEF])
+            self.assertEqual(bytes(lib.buffer(lib.table, 4)), b"\x01\x00\x02\x00")
+            self.assertEqual(
+                hashlib.sha256(lib.buffer(lib.table)).digest(), hashlib.sha256(lib.table.to_bytes()).digest()
+            )
+            self.assertEqual(lib.com.commands["memory_read"], 0)
+
+            # Views share the content of the snapshot
+            snapshot = lib.points.snapshot()
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+            view = lib.buffer(snapshot)
+            self.assertTrue(view.readonly)
+            self.assertIs(view.obj, snapshot._data)
+            self.assertEqual((snapshot[2].x, snapshot[2].y), (3, -3))
+            self.assertEqual(lib.buffer(snapshot[1]).tobytes(), b"\x02\x00\xfe\xff")
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+            # Other variables are read
+            self.assertEqual(bytes(lib.buffer(lib.points[3])), b"\x04\x00\xfc\xff")
+            self.assertEqual(lib.com.commands["memory_read"], 2)
+
+            content = bytearray(snapshot.to_bytes()[4:])
+            points = lib.from_buffer("struct point[]", content, lib.points._address + 4)
+            self.assertEqual(len(points), 3)
+            self.assertEqual([point.y for point in points], [-2, -3, -4])
+            self.assertEqual(lib.from_buffer(b"\x05\x06")[1], 6)
+            with self.assertRaises(ValueError):
+                lib.from_buffer("struct point[2]", b"\x00" * 7)
+            self.assertEqual(lib.com.commands["memory_read"], 2)
+            # Writes go to the device, unless the proxy has no device address
+            points[0].x = 7
+            self.assertEqual(lib.points[1].x, 7)
+            detached = lib.from_buffer("struct point[]", content)
+            with self.assertRaises(TypeError):
+                detached[0].x = 8
+            with self.assertRaises(TypeError):
+                lib.from_buffer(b"\x05\x06")[0] = 1
+            self.assertEqual(detached[0].x, 2)
+            if numpy is not None:
+                array = numpy.arange(4, dtype="<u2")
+                self.assertEqual(lib.from_buffer("uint16_t[]", array)[3], 3)
+
+    def test_walk(self):
+        with compile(
+            """
+            #include <stdint.h>
+            #include <stddef.h>
+            struct node { uint32_t value; struct node *next; };
+            struct tree { uint32_t value; struct tree *left; struct tree *right; };
+            struct node nodes[1000];
+            struct node *head;
+            struct tree trees[15];
+            void build(void)
+            {
+                for (size_t i = 0; i < 1000; i++)
+                {
+                    nodes[i].value = i;
+                    nodes[i].next = i < 999 ? &nodes[i + 1] : NULL;
+                }
+                // Detour breaking the constant stride
+                nodes[499].next = &nodes[700];
+                nodes[700].next = &nodes[500];
+                nodes[699].next = &nodes[701];
+                head = &nodes[0];
+                for (size_t i = 0; i < 15; i++)
+                {
+                    trees[i].value = i;
+                    trees[i].left = 2 * i + 1 < 15 ? &trees[2 * i + 1] : NULL;
+                    trees[i].right = 2 * i + 2 < 15 ? &trees[2 * i + 2] : NULL;
+                }
+            }
+            """,
+        ) as lib:
+            lib.build()
+            lib.com = CountingCommunicator(lib.com)
+            values = [node.value for node in lib.walk(lib.head)]
+            expected = list(range(500)) + [700] + list(range(500, 700)) + list(range(701, 1000))
+            self.assertEqual(values, expected)
+            self.assertLess(lib.com.commands["gather"], 20)
+            self.assertEqual(lib.com.commands["memory_read"], 1)
+
+            self.assertEqual([node.value for node in lib.walk(lib.nodes[990])], list(range(990, 1000)))
+            self.assertEqual([node.value for node in lib.walk(lib.nodes[0], limit=3, prefetch=0)], [0, 1, 2])
+            lib.nodes[2].next = lib.nodes[1]
+            self.assertEqual([node.value for node in lib.walk(lib.nodes[0])], [0, 1, 2])
+
+            lib.com.commands.clear()
+            tree = list(lib.walk(lib.trees[0], next=("left", "right")))
+            self.assertEqual([node.value for node in tree], list(range(15)))
+            self.assertEqual(lib.com.commands["gather"], 4)
+            with self.assertRaises(TypeError):
+                lib.walk(lib.trees[0], next="value")
+
+            gathered = lib.gather([lib.trees[3], lib.nodes[5]])
+            self.assertEqual([var.value for var in gathered], [3, 5])
+            self.assertEqual(lib.com.commands["gather"], 5)
+
+    def test_read_only_memory(self):
+        with compile(
+            """
+            #include <stdint.h>
+            static const uint32_t lut[64] = { 1, 1, 2, 3, 5, 8, 13, 21, [63] = 0xCAFE };
+            const uint32_t *lookup = lut;
+            """,
+        ) as lib:
+            counting = CountingCommunicator(lib.com)
+            regions = lib.backend.read_only_regions()
+            lib.com = ReadOnlyMemoryCommunicator(counting, regions)
+            table = lib.lookup[0]
+            self.assertEqual(counting.commands["memory_read"], 1)
+            self.assertEqual([table[i] for i in range(8)], [1, 1, 2, 3, 5, 8, 13, 21])
+            self.assertEqual(table[63], 0xCAFE)
+            # Writable memory is read from the device
+            pointer = lib.lookup._address
+            contents = lib.com.gather([(table._address + 4 * 63, 4), (pointer, lib.backend.sizeof_voidp)])
+            self.assertEqual(contents[0], b"\xfe\xca\0\0")
+            self.assertEqual(int.from_bytes(contents[1], "little"), table._address)
+            self.assertEqual(counting.commands["gather"], 1)
+            self.assertEqual(lib.lookup[0]._address, table._address)
+            self.assertEqual(counting.commands["memory_read"], 2)
+
+            lib.com = ReadOnlyMemoryCommunicator(counting, regions, verify=True)
+            self.assertEqual(lib.lookup[0][4], 5)
+            self.assertEqual(counting.commands["memory_read"], 4)
+            # Content of the device differing from the ELF file
+            for start, content in regions:
+                if start <= table._address < start + len(content):
+                    break
+            tampered = bytearray(content)
+            tampered[table._address - start] = 0xFF
+            lib.com = ReadOnlyMemoryCommunicator(counting, [(start, tampered)], verify=True)
+            with self.assertRaises(ValueError):
+                lib.lookup[0][0]
+            with self.assertRaises(ValueError):
+                lib.com.gather([(table._address, 4)])
+
+            # Writes would leave the local content stale
+            lib.com = ReadOnlyMemoryCommunicator(counting, regions)
+            with self.assertRaises(TypeError):
+                table[1] = 7
+            with self.assertRaises(TypeError):
+                lib.com.memory_write(table._address - 2, bytes(4))
+            lib.pyroxene_memory[0] = 7
+            self.assertEqual(lib.pyroxene_memory[0], 7)
+
+            # The views outlive the backend
+            lib.com = ReadOnlyMemoryCommunicator(counting, ElfBackend(lib.backend.file).read_only_regions())
+            gc.collect()
+            self.assertEqual(lib.lookup[0][63], 0xCAFE)
+
+            # The ELF file is mapped once
+            self.assertIs(lib.backend.read_only_regions(), regions)
+            lib.backend.close()
+            with self.assertRaises(ValueError):
+                bytes(regions[0][1])
+
+    def test_string(self):
+        with compile(
+            """
+            #include <stdint.h>
+            char message[64] = "all good";
+            const char *status = "ready";
+            const char *describe(int code)
+            {
+                return code == 0 ? "success" : "failure with a rather long description";
+            }
+            """,
+        ) as lib:
+            lib.com = CountingCommunicator(lib.com)
+            self.assertEqual(lib.string(lib.describe(0)), b"success")
+            self.assertEqual(lib.string(lib.describe(1)), b"failure with a rather long description")
+            self.assertEqual(lib.string(lib.describe(1), max_length=7), b"failure")
+            self.assertEqual(lib.com.commands["string"], 3)
+            self.assertEqual(lib.string(lib.message), b"all good")
+            self.assertEqual(lib.string(lib.message._address + 4), b"good")
+            self.assertEqual(lib.string(lib.status), b"ready")
+            self.assertEqual(lib.string(lib.message.snapshot(), max_length=3), b"all")
+            self.assertEqual(lib.com.commands["string"], 6)
+
+            # Fallback of other communicators and strings within read-only memory
+            text = b"x" * 100
+            lib.message[0:64] = list(text[:63]) + [0]
+            self.assertEqual(Communicator.string(lib.com, lib.message._address, 100), text[:63])
+            self.assertEqual(Communicator.string(lib.com, lib.message._address, 40), text[:40])
+            lib.com = ReadOnlyMemoryCommunicator(lib.com, lib.backend.read_only_regions())
+            self.assertEqual(lib.string(lib.describe(1)), b"failure with a rather long description")
+            self.assertEqual(lib.string(lib.status, max_length=2), b"re")
+            self.assertEqual(lib.com.commands["string"], 6)
+
+            # Verification compares the length of the local string too
+            status = int.from_bytes(lib.status.to_bytes(), "little")
+            for start, content in lib.backend.read_only_regions():
+                if start <= status < start + len(content):
+                    break
+            tampered = bytearray(content)
+            tampered[status - start + 5] = ord("!")
+            com = ReadOnlyMemoryCommunicator(lib.com, [(start, tampered)], verify=True)
+            with self.assertRaises(ValueError):
+                com.string(status, 100)
+
+            # Reads stop at the end of the segment
+            end = lib.backend.segment_end(lib.message._address)
+            with patch.object(
+                ReadOnlyMemoryCommunicator, "string", autospec=True, side_effect=Communicator.string
+            ) as string:
+                lib.string(end - 3)
+            self.assertEqual(string.call_args.args[1:], (end - 3, 3))